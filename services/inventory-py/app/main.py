@@ -1,13 +1,24 @@
 from __future__ import annotations
 
+import asyncio
+import base64
+import bisect
+import hashlib
+import heapq
+import json
+import math
 import os
-from datetime import datetime, timedelta
-from typing import List, Optional
+import time
+import threading
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List, Optional
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query, Request, Response
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from sqlalchemy import Column, DateTime, Float, Integer, String, ForeignKey, create_engine, select, and_, func
+from pydantic import BaseModel, Field
+from sqlalchemy import BigInteger, Column, DateTime, Float, Integer, String, ForeignKey, Index, and_, case, create_engine, insert, inspect, or_, select, text, update, func
 from sqlalchemy.orm import declarative_base, relationship, sessionmaker
 
 
@@ -33,13 +44,437 @@ class TripORM(Base):
     destination = relationship("StationORM", foreign_keys=[destination_station_id])
 
 
+# Trip search: one index per filter combination (route, origin only,
+# destination only, none), each ending in departure_time (then the implicit
+# id), which is also the keyset pagination order, so no page needs a sort
+Index("ix_trips_route_departure", TripORM.origin_station_id, TripORM.destination_station_id, TripORM.departure_time)
+Index("ix_trips_origin_departure", TripORM.origin_station_id, TripORM.departure_time)
+Index("ix_trips_destination_departure", TripORM.destination_station_id, TripORM.departure_time)
+Index("ix_trips_departure", TripORM.departure_time)
+
+
 class SeatORM(Base):
     __tablename__ = "seats"
     id = Column(Integer, primary_key=True, autoincrement=True)
-    trip_id = Column(Integer, ForeignKey("trips.id"), nullable=False, index=True)
+    trip_id = Column(Integer, ForeignKey("trips.id"), nullable=False)
     seat_no = Column(String(16), nullable=False)
     status = Column(String(16), nullable=False, default="AVAILABLE")
     hold_expires_at = Column(DateTime, nullable=True)
+    seat_class = Column(String(16), nullable=True)
+    # Bit i set = leg i (stop i -> stop i+1) is held or sold to a segment booking
+    segment_mask = Column(BigInteger, nullable=False, default=0, server_default="0")
+    # PNR of the booking a seat was sold to by /seats/sell, so the sale can be
+    # looked up (retries) or undone (/seats/release) without knowing seat_no
+    booking_ref = Column(String(26), nullable=True)
+
+
+# Allocation predicate per trip (its trip_id prefix replaces the old
+# ix_seats_trip_id), and the expiry sweep across all trips
+Index("ix_seats_trip_status_expiry", SeatORM.trip_id, SeatORM.status, SeatORM.hold_expires_at)
+Index("ix_seats_status_expiry", SeatORM.status, SeatORM.hold_expires_at)
+Index("ix_seats_trip_booking_ref", SeatORM.trip_id, SeatORM.booking_ref)
+
+
+class TripStopORM(Base):
+    # Ordered calling points of a trip; without rows the trip is a single leg
+    # origin -> destination
+    __tablename__ = "trip_stops"
+    trip_id = Column(Integer, ForeignKey("trips.id"), primary_key=True)
+    seq = Column(Integer, primary_key=True)
+    station_id = Column(Integer, ForeignKey("stations.id"), nullable=False)
+
+
+class SeatSegmentORM(Base):
+    # A seat held or sold on a leg range of a trip; leg_mask mirrors the bits
+    # it owns in seats.segment_mask
+    __tablename__ = "seat_segments"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    seat_id = Column(Integer, ForeignKey("seats.id"), nullable=False)
+    trip_id = Column(Integer, ForeignKey("trips.id"), nullable=False)
+    from_seq = Column(Integer, nullable=False)
+    to_seq = Column(Integer, nullable=False)
+    leg_mask = Column(BigInteger, nullable=False)
+    status = Column(String(16), nullable=False, default="HELD")
+    hold_expires_at = Column(DateTime, nullable=True)
+
+
+Index("ix_seat_segments_status_expiry", SeatSegmentORM.status, SeatSegmentORM.hold_expires_at)
+Index("ix_seat_segments_trip", SeatSegmentORM.trip_id, SeatSegmentORM.status)
+
+# A 64-bit mask covers 63 legs
+MAX_TRIP_STOPS = 64
+
+
+class TripAvailabilityORM(Base):
+    # Seat counters per trip, maintained in the same transaction as every seat
+    # status change so summaries never have to scan seats
+    __tablename__ = "trip_availability"
+    trip_id = Column(Integer, ForeignKey("trips.id"), primary_key=True)
+    available = Column(Integer, nullable=False, default=0)
+    held = Column(Integer, nullable=False, default=0)
+    sold = Column(Integer, nullable=False, default=0)
+    # Seats with legs held or sold to segment bookings: bookable on their free
+    # legs only, so not counted as available for whole-trip sales
+    partial = Column(Integer, nullable=False, default=0, server_default="0")
+
+
+# How many times a contended allocation is retried before giving up
+SEAT_CLAIM_RETRIES = 5
+
+
+def seat_is_available():
+    # Whole-trip allocation only takes seats no segment booking has touched
+    return (SeatORM.status == "AVAILABLE") & (SeatORM.segment_mask == 0)
+
+
+def seat_hold_lapsed(now: datetime):
+    return (SeatORM.status == "HELD") & ((SeatORM.hold_expires_at == None) | (SeatORM.hold_expires_at < now))  # noqa: E711
+
+
+def claim_seat(session, trip_id: int, claimable, **values):
+    # Pick and hold (or sell, depending on values) the first matching seat in a
+    # single UPDATE. The predicate is re-checked on the row being written, so
+    # two workers can never take the same seat: the loser updates zero rows.
+    candidate = (
+        select(SeatORM.id)
+        .where(SeatORM.trip_id == trip_id, claimable)
+        .order_by(SeatORM.id)
+        .limit(1)
+        .scalar_subquery()
+    )
+    return session.execute(
+        update(SeatORM)
+        .where(SeatORM.id == candidate, claimable)
+        .values(**values)
+        .returning(SeatORM.id, SeatORM.seat_no, SeatORM.hold_expires_at)
+        .execution_options(synchronize_session=False)
+    ).first()
+
+
+def adjust_availability(
+    session, trip_id: int, available: int = 0, held: int = 0, sold: int = 0, partial: int = 0
+) -> None:
+    session.execute(
+        update(TripAvailabilityORM)
+        .where(TripAvailabilityORM.trip_id == trip_id)
+        .values(
+            available=TripAvailabilityORM.available + available,
+            held=TripAvailabilityORM.held + held,
+            sold=TripAvailabilityORM.sold + sold,
+            partial=TripAvailabilityORM.partial + partial,
+        )
+    )
+
+
+def backfill_availability(session) -> None:
+    # Build counters for trips seeded before trip_availability existed
+    def tally(condition):
+        return func.sum(case((condition, 1), else_=0))
+
+    counted = select(TripAvailabilityORM.trip_id)
+    session.execute(
+        insert(TripAvailabilityORM).from_select(
+            ["trip_id", "available", "held", "sold", "partial"],
+            select(
+                SeatORM.trip_id,
+                tally(seat_is_available()),
+                tally(SeatORM.status == "HELD"),
+                tally(SeatORM.status == "SOLD"),
+                tally((SeatORM.status == "AVAILABLE") & (SeatORM.segment_mask != 0)),
+            )
+            .where(SeatORM.trip_id.not_in(counted))
+            .group_by(SeatORM.trip_id),
+        )
+    )
+
+
+class HoldExpiryIndex:
+    # Min-heap of (hold_expires_at, seat_id) for holds taken by this process.
+    # Entries are never removed on confirm/re-hold: the sweep UPDATE re-checks
+    # status and expiry, so stale entries are harmless.
+
+    def __init__(self) -> None:
+        self._heap: List[tuple] = []
+        self._lock = threading.Lock()
+
+    def push(self, seat_id: int, expires_at: datetime) -> None:
+        with self._lock:
+            heapq.heappush(self._heap, (expires_at, seat_id))
+
+    def pop_due(self, now: datetime) -> List[int]:
+        due: List[int] = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                due.append(heapq.heappop(self._heap)[1])
+        return due
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+
+def leg_range_mask(from_seq: int, to_seq: int) -> int:
+    return ((1 << to_seq) - 1) ^ ((1 << from_seq) - 1)
+
+
+def pick_segment_seat(candidates, leg_mask: int) -> Optional[tuple]:
+    # Best fit over (seat_id, segment_mask) rows in seat order: among seats
+    # free on the requested legs, take the one already most used elsewhere so
+    # untouched seats stay available for end-to-end passengers
+    best = None
+    best_used = -1
+    for seat_id, mask in candidates:
+        if mask & leg_mask:
+            continue
+        used = mask.bit_count()
+        if used > best_used:
+            best, best_used = (seat_id, mask), used
+    return best
+
+
+def pick_seat_block(seat_ids: List[int], count: int) -> List[int]:
+    # Seats are numbered in seeding order, so the tightest window of `count`
+    # free ids is the most contiguous block (span == count - 1 means adjacent).
+    best = 0
+    for start in range(1, len(seat_ids) - count + 1):
+        if seat_ids[start + count - 1] - seat_ids[start] < seat_ids[best + count - 1] - seat_ids[best]:
+            best = start
+            if seat_ids[best + count - 1] - seat_ids[best] == count - 1:
+                break
+    return seat_ids[best:best + count]
+
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def to_epoch(value: datetime) -> float:
+    # Timetable datetimes are naive UTC; aware ones (e.g. "...Z" in a query)
+    # are converted first
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return (value - EPOCH).total_seconds()
+
+
+class JourneyPlanner:
+    # Connection Scan over the timetable: every trip is one elementary
+    # connection (dep, arr, from_station, to_station, trip_id), kept sorted by
+    # departure. Trips are appended incrementally (sync picks up rows created
+    # by other workers through a primary-key range read). The list is replaced,
+    # never mutated, so concurrent scans keep a consistent snapshot.
+
+    def __init__(self) -> None:
+        self._connections: List[tuple] = []
+        self._last_trip_id = 0
+        self._lock = threading.Lock()
+
+    def add(self, rows) -> None:
+        with self._lock:
+            fresh = [
+                (to_epoch(r.departure_time), to_epoch(r.arrival_time), r.origin_station_id, r.destination_station_id, r.id)
+                for r in rows
+                if r.id > self._last_trip_id
+            ]
+            if not fresh:
+                return
+            self._last_trip_id = max(c[4] for c in fresh)
+            if len(fresh) > 64:
+                self._connections = sorted(self._connections + fresh)
+            else:
+                connections = list(self._connections)
+                for connection in fresh:
+                    bisect.insort(connections, connection)
+                self._connections = connections
+
+    def sync(self, session) -> None:
+        rows = session.execute(
+            select(
+                TripORM.id,
+                TripORM.origin_station_id,
+                TripORM.destination_station_id,
+                TripORM.departure_time,
+                TripORM.arrival_time,
+            ).where(TripORM.id > self._last_trip_id)
+        ).all()
+        if rows:
+            self.add(rows)
+
+    def __len__(self) -> int:
+        return len(self._connections)
+
+    def plan(
+        self, origin: int, destination: int, depart_after: float, max_legs: int, min_transfer: float, horizon: float
+    ) -> List[tuple]:
+        # Round k only boards from stations reached with k-1 legs, so each
+        # round yields the earliest arrival with at most k legs. Keeping the
+        # rounds that strictly improve the arrival gives the Pareto set over
+        # (arrival time, number of transfers).
+        connections = self._connections
+        start = bisect.bisect_left(connections, (depart_after,))
+        reached: Dict[int, float] = {origin: depart_after}
+        journeys: Dict[int, tuple] = {origin: ()}
+        best_arrival = depart_after + horizon
+        pareto: List[tuple] = []
+        for _ in range(max_legs):
+            next_reached = dict(reached)
+            next_journeys = dict(journeys)
+            for i in range(start, len(connections)):
+                dep, arr, frm, to, trip_id = connections[i]
+                if dep >= best_arrival:
+                    break
+                ready = reached.get(frm)
+                if ready is None or ready + (min_transfer if frm != origin else 0) > dep:
+                    continue
+                if arr < next_reached.get(to, float("inf")):
+                    next_reached[to] = arr
+                    next_journeys[to] = journeys[frm] + (trip_id,)
+                    if to == destination:
+                        best_arrival = arr
+            if next_reached == reached:
+                break
+            if next_reached.get(destination, float("inf")) < (pareto[-1][0] if pareto else float("inf")):
+                pareto.append((next_reached[destination], next_journeys[destination]))
+            reached, journeys = next_reached, next_journeys
+        return [legs for _, legs in pareto]
+
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+def unit_vector(latitude: float, longitude: float) -> tuple:
+    lat, lon = math.radians(latitude), math.radians(longitude)
+    return (math.cos(lat) * math.cos(lon), math.cos(lat) * math.sin(lon), math.sin(lat))
+
+
+class StationSpatialIndex:
+    # Immutable snapshot rebuilt whenever stations are added: a 3-d tree over
+    # unit vectors (chord length orders points like great-circle distance, with
+    # no trouble at the antimeridian) for nearest-K, and a latitude-sorted
+    # array for bounding boxes. The four parts are published together as one
+    # tuple, so a query never mixes two snapshots. Other workers' stations are
+    # picked up by a throttled primary-key range read.
+
+    SYNC_SECONDS = 5.0
+
+    def __init__(self) -> None:
+        # (stations by id, 3-d tree, stations by latitude, their latitudes)
+        self._snapshot: tuple = ({}, None, [], [])
+        self._last_station_id = 0
+        self._synced_at = float("-inf")
+        self._lock = threading.Lock()
+
+    def add(self, rows) -> None:
+        with self._lock:
+            stations = dict(self._snapshot[0])
+            for r in rows:
+                stations[r.id] = (r.id, r.name, r.latitude, r.longitude)
+                self._last_station_id = max(self._last_station_id, r.id)
+            points = [(unit_vector(st[2], st[3]), st) for st in stations.values()]
+            by_latitude = sorted(stations.values(), key=lambda st: st[2])
+            self._snapshot = (stations, self._build(points, 0), by_latitude, [st[2] for st in by_latitude])
+
+    def sync(self, session, force: bool = False) -> None:
+        if not force and time.monotonic() - self._synced_at < self.SYNC_SECONDS:
+            return
+        rows = session.execute(
+            select(StationORM.id, StationORM.name, StationORM.latitude, StationORM.longitude)
+            .where(StationORM.id > self._last_station_id)
+        ).all()
+        if rows:
+            self.add(rows)
+        self._synced_at = time.monotonic()
+
+    @classmethod
+    def _build(cls, points: List[tuple], depth: int):
+        if not points:
+            return None
+        axis = depth % 3
+        points.sort(key=lambda p: p[0][axis])
+        mid = len(points) // 2
+        return points[mid], axis, cls._build(points[:mid], depth + 1), cls._build(points[mid + 1:], depth + 1)
+
+    def nearest(self, latitude: float, longitude: float, k: int) -> List[tuple]:
+        target = unit_vector(latitude, longitude)
+        best: List[tuple] = []  # max-heap on squared chord length
+
+        def visit(node) -> None:
+            if node is None:
+                return
+            (vec, station), axis, left, right = node
+            d2 = (vec[0] - target[0]) ** 2 + (vec[1] - target[1]) ** 2 + (vec[2] - target[2]) ** 2
+            if len(best) < k:
+                heapq.heappush(best, (-d2, station))
+            elif d2 < -best[0][0]:
+                heapq.heapreplace(best, (-d2, station))
+            diff = target[axis] - vec[axis]
+            near, far = (left, right) if diff < 0 else (right, left)
+            visit(near)
+            if len(best) < k or diff * diff < -best[0][0]:
+                visit(far)
+
+        visit(self._snapshot[1])
+        return [
+            (2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(-neg_d2) / 2)), station)
+            for neg_d2, station in sorted(best, reverse=True)
+        ]
+
+    def within(self, min_lat: float, min_lon: float, max_lat: float, max_lon: float) -> List[tuple]:
+        _, _, by_latitude, latitudes = self._snapshot
+        lo = bisect.bisect_left(latitudes, min_lat)
+        hi = bisect.bisect_right(latitudes, max_lat)
+        if min_lon <= max_lon:
+            return [st for st in by_latitude[lo:hi] if min_lon <= st[3] <= max_lon]
+        # Box crossing the antimeridian
+        return [st for st in by_latitude[lo:hi] if st[3] >= min_lon or st[3] <= max_lon]
+
+
+class CachedBody:
+    __slots__ = ("body", "etag", "version", "expires_at")
+
+    def __init__(self, body: bytes, version: int, expires_at: float) -> None:
+        self.body = body
+        self.etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+        self.version = version
+        self.expires_at = expires_at
+
+
+class VersionedCache:
+    # Read-through cache of serialized JSON bodies for reference data that is
+    # read constantly and written rarely (stations, trips). Writers call bump();
+    # a load that raced with a bump is not stored. The TTL bounds staleness for
+    # writes made by other worker processes.
+
+    def __init__(self, enabled: bool = True, ttl_seconds: float = 30.0) -> None:
+        self.enabled = enabled
+        self.ttl_seconds = ttl_seconds
+        self.version = 0
+        self._entries: Dict[str, CachedBody] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str, loader: Callable[[], object]) -> CachedBody:
+        now = time.monotonic()
+        entry = self._entries.get(key) if self.enabled else None
+        if entry is not None and entry.version == self.version and entry.expires_at > now:
+            return entry
+        version = self.version
+        body = json.dumps(jsonable_encoder(loader()), separators=(",", ":")).encode()
+        entry = CachedBody(body, version, now + self.ttl_seconds)
+        if self.enabled:
+            with self._lock:
+                if self.version == version:
+                    self._entries[key] = entry
+        return entry
+
+    def bump(self) -> None:
+        with self._lock:
+            self.version += 1
+            self._entries.clear()
+
+
+def cached_json(request: Request, cache: VersionedCache, key: str, loader: Callable[[], object]) -> Response:
+    entry = cache.get(key, loader)
+    headers = {"ETag": entry.etag, "Cache-Control": "no-cache"}
+    if entry.etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+    return Response(content=entry.body, media_type="application/json", headers=headers)
 
 
 class Station(BaseModel):
@@ -49,6 +484,10 @@ class Station(BaseModel):
     longitude: float
 
 
+class NearbyStation(Station):
+    distance_km: float
+
+
 class StationCreate(BaseModel):
     name: str
     latitude: float
@@ -63,6 +502,32 @@ class Trip(BaseModel):
     arrival_time: datetime
 
 
+class TripPage(BaseModel):
+    items: List[Trip]
+    next_cursor: Optional[str] = None
+
+
+def encode_trip_cursor(departure_time: datetime, trip_id: int) -> str:
+    raw = json.dumps([departure_time.isoformat(), trip_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_trip_cursor(cursor: str) -> tuple:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        departure, trip_id = json.loads(raw)
+        return datetime.fromisoformat(departure), int(trip_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+class Journey(BaseModel):
+    departure_time: datetime
+    arrival_time: datetime
+    transfers: int
+    legs: List[Trip]
+
+
 class TripCreate(BaseModel):
     origin_station_id: int
     destination_station_id: int
@@ -74,6 +539,85 @@ class Seat(BaseModel):
     seat_no: str
     status: str
     hold_expires_at: Optional[datetime] = None
+    seat_class: Optional[str] = None
+    # PARTIAL seats: legs (i = stop i -> stop i+1) held or sold to segment bookings
+    occupied_legs: Optional[List[int]] = None
+
+
+class TripStops(BaseModel):
+    station_ids: List[int] = Field(..., min_length=2, max_length=MAX_TRIP_STOPS)
+
+
+class SeatSegment(BaseModel):
+    id: int
+    seat_no: str
+    from_station_id: int
+    to_station_id: int
+    status: str
+    hold_expires_at: Optional[datetime] = None
+
+
+class SeatZone(BaseModel):
+    seat_class: str = "SECOND"
+    rows: int = Field(..., ge=1, le=60)
+    columns: str = Field("ABCD", min_length=1, max_length=8)
+
+
+class CoachLayout(BaseModel):
+    coach: str = Field(..., min_length=1, max_length=4)
+    zones: List[SeatZone]
+
+
+class SeatLayout(BaseModel):
+    coaches: List[CoachLayout]
+
+
+class SeatBulkSeed(BaseModel):
+    trip_ids: List[int] = Field(..., min_length=1, max_length=1000)
+    template: str = "standard"
+    layout: Optional[SeatLayout] = None  # overrides template when given
+
+
+# Coaches are laid out front to back; rows are numbered per coach across its
+# zones, so "2-14C" is coach 2, row 14, seat C.
+SEAT_LAYOUTS = {
+    "standard": SeatLayout(coaches=[
+        CoachLayout(coach="1", zones=[SeatZone(seat_class="SECOND", rows=25, columns="ABCD")]),
+    ]),
+    "transgabonais": SeatLayout(coaches=[
+        CoachLayout(coach="1", zones=[SeatZone(seat_class="VIP", rows=6, columns="ABC")]),
+        CoachLayout(coach="2", zones=[
+            SeatZone(seat_class="FIRST", rows=8, columns="ABC"),
+            SeatZone(seat_class="SECOND", rows=8, columns="ABCD"),
+        ]),
+        CoachLayout(coach="3", zones=[SeatZone(seat_class="SECOND", rows=18, columns="ABCD")]),
+        CoachLayout(coach="4", zones=[SeatZone(seat_class="SECOND", rows=18, columns="ABCD")]),
+    ]),
+}
+
+
+def expand_layout(layout: SeatLayout) -> List[tuple]:
+    seats: List[tuple] = []
+    for coach in layout.coaches:
+        row_no = 0
+        for zone in coach.zones:
+            for _ in range(zone.rows):
+                row_no += 1
+                seats.extend((f"{coach.coach}-{row_no}{col}", zone.seat_class) for col in zone.columns)
+    return seats
+
+
+class Availability(BaseModel):
+    trip_id: int
+    available: int
+    held: int
+    sold: int
+    # Seats partly booked by segment; see TripAvailabilityORM.partial
+    partial: int = 0
+
+
+def availability_out(row: TripAvailabilityORM) -> Availability:
+    return Availability(trip_id=row.trip_id, available=row.available, held=row.held, sold=row.sold, partial=row.partial)
 
 
 def create_app() -> FastAPI:
@@ -90,24 +634,186 @@ def create_app() -> FastAPI:
                            connect_args={"check_same_thread": False} if db_url.startswith("sqlite") else {})
     SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False, future=True)
     Base.metadata.create_all(bind=engine)
+    seat_columns = {c["name"] for c in inspect(engine).get_columns("seats")}
+    for name, ddl in (
+        ("seat_class", "VARCHAR(16)"),
+        ("segment_mask", "BIGINT NOT NULL DEFAULT 0"),
+        ("booking_ref", "VARCHAR(26)"),
+    ):
+        if name not in seat_columns:
+            with engine.begin() as conn:
+                conn.execute(text(f"ALTER TABLE seats ADD COLUMN {name} {ddl}"))
+    # create_all skips indexes of tables that already exist
+    for index in [*SeatORM.__table__.indexes, *TripORM.__table__.indexes]:
+        index.create(bind=engine, checkfirst=True)
+    with engine.begin() as conn:
+        # Superseded by ix_seats_trip_status_expiry; left in place the planner
+        # prefers it for ORDER BY id and walks every sold seat of the trip
+        conn.execute(text("DROP INDEX IF EXISTS ix_seats_trip_id"))
+    if "partial" not in {c["name"] for c in inspect(engine).get_columns("trip_availability")}:
+        with engine.begin() as conn:
+            conn.execute(text("ALTER TABLE trip_availability ADD COLUMN partial INTEGER NOT NULL DEFAULT 0"))
+            # Seats with segment bookings were counted as available until now
+            conn.execute(text(
+                "UPDATE trip_availability SET partial = (SELECT COUNT(*) FROM seats"
+                " WHERE seats.trip_id = trip_availability.trip_id"
+                " AND seats.status = 'AVAILABLE' AND seats.segment_mask != 0)"
+            ))
+            conn.execute(text("UPDATE trip_availability SET available = available - partial"))
+    with SessionLocal() as session:
+        backfill_availability(session)
+        session.commit()
+
+    hold_expiry = HoldExpiryIndex()
+    journey_planner = JourneyPlanner()
+    station_index = StationSpatialIndex()
+    read_cache = VersionedCache(
+        enabled=os.getenv("INVENTORY_READ_CACHE", "1") != "0",
+        ttl_seconds=float(os.getenv("INVENTORY_READ_CACHE_TTL", "30")),
+    )
+    sweep_seconds = float(os.getenv("INVENTORY_HOLD_SWEEP_SECONDS", "5"))
+    full_sweep_seconds = float(os.getenv("INVENTORY_HOLD_FULL_SWEEP_SECONDS", "60"))
+
+    def release_expired_holds(now: datetime, seat_ids: Optional[List[int]] = None) -> int:
+        # Bulk return lapsed holds to AVAILABLE. Without seat_ids this scans
+        # every trip through ix_seats_status_expiry (holds from other workers
+        # or from before a restart); with seat_ids it only touches those rows.
+        stmt = update(SeatORM).where(seat_hold_lapsed(now))
+        if seat_ids is not None:
+            stmt = stmt.where(SeatORM.id.in_(seat_ids))
+        with SessionLocal() as session:
+            released = session.execute(
+                stmt.values(status="AVAILABLE", hold_expires_at=None)
+                .returning(SeatORM.trip_id)
+                .execution_options(synchronize_session=False)
+            ).scalars().all()
+            for trip_id, n in Counter(released).items():
+                adjust_availability(session, trip_id, available=n, held=-n)
+            session.commit()
+            return len(released)
+
+    def release_expired_segments(now: datetime) -> int:
+        with SessionLocal() as session:
+            expired = session.execute(
+                update(SeatSegmentORM)
+                .where(SeatSegmentORM.status == "HELD", SeatSegmentORM.hold_expires_at < now)
+                .values(status="EXPIRED")
+                .returning(SeatSegmentORM.seat_id, SeatSegmentORM.leg_mask)
+                .execution_options(synchronize_session=False)
+            ).all()
+            freed: Dict[int, int] = {}
+            for seat_id, leg_mask in expired:
+                freed[seat_id] = freed.get(seat_id, 0) | leg_mask
+            for seat_id, leg_mask in freed.items():
+                seat = session.execute(
+                    update(SeatORM)
+                    .where(SeatORM.id == seat_id)
+                    .values(segment_mask=SeatORM.segment_mask.op("&")(~leg_mask))
+                    .returning(SeatORM.trip_id, SeatORM.segment_mask)
+                    .execution_options(synchronize_session=False)
+                ).first()
+                if seat is not None and seat.segment_mask == 0:
+                    # Last segment gone: the seat is sellable end to end again
+                    adjust_availability(session, seat.trip_id, available=1, partial=-1)
+            session.commit()
+            return len(expired)
+
+    async def run_hold_sweeper() -> None:
+        loop = asyncio.get_running_loop()
+        last_full_sweep = loop.time()
+        while True:
+            await asyncio.sleep(sweep_seconds)
+            now = datetime.utcnow()
+            try:
+                if loop.time() - last_full_sweep >= full_sweep_seconds:
+                    hold_expiry.pop_due(now)
+                    await asyncio.to_thread(release_expired_holds, now)
+                    last_full_sweep = loop.time()
+                else:
+                    due = hold_expiry.pop_due(now)
+                    if due:
+                        await asyncio.to_thread(release_expired_holds, now, due)
+                await asyncio.to_thread(release_expired_segments, now)
+            except Exception:
+                # Keep sweeping; lapsed holds stay claimable by allocate_seat meanwhile
+                continue
+
+    @app.on_event("startup")
+    async def on_startup() -> None:
+        # Holds left over from a previous run are released right away
+        await asyncio.to_thread(release_expired_holds, datetime.utcnow())
+        with SessionLocal() as session:
+            held = session.execute(
+                select(SeatORM.id, SeatORM.hold_expires_at).where(
+                    SeatORM.status == "HELD", SeatORM.hold_expires_at != None  # noqa: E711
+                )
+            ).all()
+        for seat_id, expires_at in held:
+            hold_expiry.push(seat_id, expires_at)
+        app.state.hold_sweeper_task = asyncio.create_task(run_hold_sweeper())
+
+    @app.on_event("shutdown")
+    async def on_shutdown() -> None:
+        task: asyncio.Task | None = getattr(app.state, "hold_sweeper_task", None)
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
 
     @app.get("/health")
     def health() -> dict:
         return {"status": "ok"}
 
     @app.get("/stations")
-    def list_stations():
+    def list_stations(request: Request):
+        def load():
+            with SessionLocal() as session:
+                stations = session.execute(select(StationORM)).scalars().all()
+                return [{"id": s.id, "name": s.name, "latitude": s.latitude, "longitude": s.longitude} for s in stations]
+
+        return cached_json(request, read_cache, "stations", load)
+
+    @app.get("/stations/nearest", response_model=List[NearbyStation])
+    def nearest_stations(
+        latitude: float = Query(..., ge=-90, le=90),
+        longitude: float = Query(..., ge=-180, le=180),
+        k: int = Query(5, ge=1, le=100),
+        max_km: Optional[float] = Query(None, gt=0),
+    ) -> List[NearbyStation]:
         with SessionLocal() as session:
-            stations = session.execute(select(StationORM)).scalars().all()
-            return [{"id": s.id, "name": s.name, "latitude": s.latitude, "longitude": s.longitude} for s in stations]
+            station_index.sync(session)
+        return [
+            NearbyStation(id=st[0], name=st[1], latitude=st[2], longitude=st[3], distance_km=round(km, 3))
+            for km, st in station_index.nearest(latitude, longitude, k)
+            if max_km is None or km <= max_km
+        ]
 
-    @app.get("/stations/{station_id}")
-    def get_station(station_id: int):
+    @app.get("/stations/within", response_model=List[Station])
+    def stations_within(
+        min_latitude: float = Query(..., ge=-90, le=90),
+        min_longitude: float = Query(..., ge=-180, le=180),
+        max_latitude: float = Query(..., ge=-90, le=90),
+        max_longitude: float = Query(..., ge=-180, le=180),
+    ) -> List[Station]:
         with SessionLocal() as session:
-            station = session.execute(select(StationORM).where(StationORM.id == station_id)).scalar_one_or_none()
-            if not station:
-                raise HTTPException(status_code=404, detail="Station not found")
-            return {"id": station.id, "name": station.name, "latitude": station.latitude, "longitude": station.longitude}
+            station_index.sync(session)
+        return [
+            Station(id=st[0], name=st[1], latitude=st[2], longitude=st[3])
+            for st in station_index.within(min_latitude, min_longitude, max_latitude, max_longitude)
+        ]
+
+    @app.get("/stations/{station_id}")
+    def get_station(station_id: int, request: Request):
+        def load():
+            with SessionLocal() as session:
+                station = session.execute(select(StationORM).where(StationORM.id == station_id)).scalar_one_or_none()
+                if not station:
+                    raise HTTPException(status_code=404, detail="Station not found")
+                return {"id": station.id, "name": station.name, "latitude": station.latitude, "longitude": station.longitude}
+
+        return cached_json(request, read_cache, f"stations/{station_id}", load)
 
     @app.post("/stations", response_model=Station, status_code=201)
     def create_station(body: StationCreate) -> Station:
@@ -116,22 +822,123 @@ def create_app() -> FastAPI:
             session.add(row)
             session.commit()
             session.refresh(row)
+            read_cache.bump()
+            # Range read from the watermark, not add([row]): stations this
+            # worker has not loaded yet must not end up below it
+            station_index.sync(session, force=True)
             return Station(id=row.id, name=row.name, latitude=row.latitude, longitude=row.longitude)
 
     @app.get("/trips", response_model=List[Trip])
-    def list_trips() -> List[Trip]:
-        with SessionLocal() as session:
-            rows = session.execute(select(TripORM)).scalars().all()
-            return [
-                Trip(
-                    id=r.id,
-                    origin_station_id=r.origin_station_id,
-                    destination_station_id=r.destination_station_id,
-                    departure_time=r.departure_time,
-                    arrival_time=r.arrival_time,
+    def list_trips(request: Request, trip_ids: Optional[List[int]] = Query(None, alias="trip_id", max_length=200)):
+        # ?trip_id=1&trip_id=2... fetches just those trips in one call (batch pricing)
+        def load():
+            with SessionLocal() as session:
+                stmt = select(TripORM)
+                if trip_ids:
+                    stmt = stmt.where(TripORM.id.in_(trip_ids))
+                rows = session.execute(stmt).scalars().all()
+                return [
+                    Trip(
+                        id=r.id,
+                        origin_station_id=r.origin_station_id,
+                        destination_station_id=r.destination_station_id,
+                        departure_time=r.departure_time,
+                        arrival_time=r.arrival_time,
+                    )
+                    for r in rows
+                ]
+
+        if trip_ids:
+            # Id sets differ from one search page to the next: caching each one
+            # would only grow the cache until the next bump()
+            return load()
+        return cached_json(request, read_cache, "trips", load)
+
+    @app.get("/trips/search", response_model=TripPage)
+    def search_trips(
+        origin_station_id: Optional[int] = None,
+        destination_station_id: Optional[int] = None,
+        departure_from: Optional[datetime] = Query(None, description="ISO8601 earliest departure"),
+        departure_to: Optional[datetime] = Query(None, description="ISO8601 latest departure"),
+        limit: int = Query(50, ge=1, le=200),
+        cursor: Optional[str] = None,
+    ) -> TripPage:
+        # Keyset pagination on (departure_time, id): each page is an index
+        # seek from the cursor, whatever the page number
+        stmt = select(
+            TripORM.id,
+            TripORM.origin_station_id,
+            TripORM.destination_station_id,
+            TripORM.departure_time,
+            TripORM.arrival_time,
+        )
+        if origin_station_id is not None:
+            stmt = stmt.where(TripORM.origin_station_id == origin_station_id)
+        if destination_station_id is not None:
+            stmt = stmt.where(TripORM.destination_station_id == destination_station_id)
+        if departure_from is not None:
+            stmt = stmt.where(TripORM.departure_time >= departure_from)
+        if departure_to is not None:
+            stmt = stmt.where(TripORM.departure_time <= departure_to)
+        if cursor:
+            after_departure, after_id = decode_trip_cursor(cursor)
+            stmt = stmt.where(or_(
+                TripORM.departure_time > after_departure,
+                and_(TripORM.departure_time == after_departure, TripORM.id > after_id),
+            ))
+        stmt = stmt.order_by(TripORM.departure_time, TripORM.id).limit(limit + 1)
+        with SessionLocal() as session:
+            rows = session.execute(stmt).all()
+        items = [Trip(**r._mapping) for r in rows[:limit]]
+        next_cursor = None
+        if len(rows) > limit:
+            last = items[-1]
+            next_cursor = encode_trip_cursor(last.departure_time, last.id)
+        return TripPage(items=items, next_cursor=next_cursor)
+
+    @app.get("/journeys", response_model=List[Journey])
+    def plan_journeys(
+        origin_station_id: int,
+        destination_station_id: int,
+        depart_after: Optional[datetime] = Query(None, description="ISO8601, defaults to now"),
+        max_legs: int = Query(3, ge=1, le=6),
+        min_transfer_minutes: int = Query(10, ge=0, le=24 * 60),
+        horizon_hours: int = Query(48, ge=1, le=14 * 24),
+    ) -> List[Journey]:
+        # Pareto-optimal itineraries: fastest arrival for each number of transfers
+        # that actually improves on fewer transfers
+        with SessionLocal() as session:
+            journey_planner.sync(session)
+            itineraries = journey_planner.plan(
+                origin_station_id,
+                destination_station_id,
+                to_epoch(depart_after or datetime.utcnow()),
+                max_legs,
+                min_transfer_minutes * 60,
+                horizon_hours * 3600,
+            )
+            trip_ids = {trip_id for legs in itineraries for trip_id in legs}
+            trips = {
+                r.id: Trip(**r._mapping)
+                for r in session.execute(
+                    select(
+                        TripORM.id,
+                        TripORM.origin_station_id,
+                        TripORM.destination_station_id,
+                        TripORM.departure_time,
+                        TripORM.arrival_time,
+                    ).where(TripORM.id.in_(trip_ids))
                 )
-                for r in rows
-            ]
+            }
+        return [
+            Journey(
+                departure_time=trips[legs[0]].departure_time,
+                arrival_time=trips[legs[-1]].arrival_time,
+                transfers=len(legs) - 1,
+                legs=[trips[trip_id] for trip_id in legs],
+            )
+            for legs in itineraries
+        ]
 
     @app.post("/trips", response_model=Trip, status_code=201)
     def create_trip(body: TripCreate) -> Trip:
@@ -149,6 +956,10 @@ def create_app() -> FastAPI:
             session.add(row)
             session.commit()
             session.refresh(row)
+            read_cache.bump()
+            # Range read from the watermark, not add([row]): trips this worker
+            # has not loaded yet (fresh start, other workers) come along too
+            journey_planner.sync(session)
             return Trip(
                 id=row.id,
                 origin_station_id=row.origin_station_id,
@@ -157,60 +968,153 @@ def create_app() -> FastAPI:
                 arrival_time=row.arrival_time,
             )
 
+    def insert_seat_maps(session, trip_ids: List[int], seat_map: List[tuple]) -> None:
+        # Set-based: one executemany for the seats, one for the counters
+        session.execute(
+            insert(SeatORM),
+            [
+                {"trip_id": trip_id, "seat_no": seat_no, "seat_class": seat_class, "status": "AVAILABLE"}
+                for trip_id in trip_ids
+                for seat_no, seat_class in seat_map
+            ],
+        )
+        session.execute(
+            insert(TripAvailabilityORM),
+            [{"trip_id": trip_id, "available": len(seat_map), "held": 0, "sold": 0, "partial": 0} for trip_id in trip_ids],
+        )
+
     @app.post("/trips/{trip_id}/seats/seed", response_model=List[Seat])
-    def seed_seats(trip_id: int, count: int = 100) -> List[Seat]:
+    def seed_seats(trip_id: int, count: int = 100, template: Optional[str] = None) -> List[Seat]:
         with SessionLocal() as session:
             trip = session.get(TripORM, trip_id)
             if not trip:
                 raise HTTPException(status_code=404, detail="Trip not found")
-            # Create N seats like 1A,1B,...
-            created: List[Seat] = []
             existing_count = session.execute(select(func.count(SeatORM.id)).where(SeatORM.trip_id == trip_id)).scalar_one()
             if existing_count and existing_count > 0:
                 # Do not duplicate
-                rows = session.execute(select(SeatORM).where(SeatORM.trip_id == trip_id)).scalars().all()
-                return [Seat(seat_no=r.seat_no, status=r.status, hold_expires_at=r.hold_expires_at) for r in rows]
-            rows_to_add: List[SeatORM] = []
-            for i in range(1, count + 1):
-                seat_no = f"{i}A"
-                rows_to_add.append(SeatORM(trip_id=trip_id, seat_no=seat_no, status="AVAILABLE"))
-            session.add_all(rows_to_add)
+                rows = session.execute(select(SeatORM).where(SeatORM.trip_id == trip_id).order_by(SeatORM.id)).scalars().all()
+                return [Seat(seat_no=r.seat_no, status=r.status, hold_expires_at=r.hold_expires_at, seat_class=r.seat_class) for r in rows]
+            if template is not None:
+                if template not in SEAT_LAYOUTS:
+                    raise HTTPException(status_code=400, detail="Unknown seat layout template")
+                seat_map = expand_layout(SEAT_LAYOUTS[template])
+            else:
+                # Create N seats like 1A,2A,...
+                seat_map = [(f"{i}A", None) for i in range(1, count + 1)]
+            insert_seat_maps(session, [trip_id], seat_map)
             session.commit()
-            rows = session.execute(select(SeatORM).where(SeatORM.trip_id == trip_id).order_by(SeatORM.id)).scalars().all()
-            return [Seat(seat_no=r.seat_no, status=r.status, hold_expires_at=r.hold_expires_at) for r in rows]
+            return [Seat(seat_no=seat_no, status="AVAILABLE", seat_class=seat_class) for seat_no, seat_class in seat_map]
+
+    @app.post("/seats/seed", response_model=List[Availability])
+    def seed_seats_bulk(body: SeatBulkSeed) -> List[Availability]:
+        if body.layout is not None:
+            seat_map = expand_layout(body.layout)
+        elif body.template in SEAT_LAYOUTS:
+            seat_map = expand_layout(SEAT_LAYOUTS[body.template])
+        else:
+            raise HTTPException(status_code=400, detail="Unknown seat layout template")
+        if len({seat_no for seat_no, _ in seat_map}) != len(seat_map):
+            raise HTTPException(status_code=400, detail="Duplicate seat numbers in layout")
+        trip_ids = sorted(set(body.trip_ids))
+        with SessionLocal() as session:
+            known = set(session.execute(select(TripORM.id).where(TripORM.id.in_(trip_ids))).scalars())
+            if len(known) != len(trip_ids):
+                raise HTTPException(status_code=404, detail=f"Trip not found: {sorted(set(trip_ids) - known)}")
+            # Trips that already have seats are left untouched, like seed_seats
+            seeded = set(session.execute(
+                select(SeatORM.trip_id).where(SeatORM.trip_id.in_(trip_ids)).distinct()
+            ).scalars())
+            to_seed = [trip_id for trip_id in trip_ids if trip_id not in seeded]
+            if to_seed:
+                insert_seat_maps(session, to_seed, seat_map)
+            session.commit()
+            rows = session.execute(
+                select(TripAvailabilityORM).where(TripAvailabilityORM.trip_id.in_(trip_ids))
+            ).scalars().all()
+            return [availability_out(r) for r in rows]
 
     @app.get("/trips/{trip_id}/seats", response_model=List[Seat])
     def list_seats(trip_id: int) -> List[Seat]:
+        now = datetime.utcnow()
         with SessionLocal() as session:
             rows = session.execute(select(SeatORM).where(SeatORM.trip_id == trip_id).order_by(SeatORM.id)).scalars().all()
-            return [Seat(seat_no=r.seat_no, status=r.status, hold_expires_at=r.hold_expires_at) for r in rows]
+            seats: List[Seat] = []
+            for r in rows:
+                if r.status == "AVAILABLE" and r.segment_mask:
+                    # Bookable on its free legs only (segments), not end to end
+                    legs = [i for i in range(r.segment_mask.bit_length()) if r.segment_mask >> i & 1]
+                    seats.append(Seat(seat_no=r.seat_no, status="PARTIAL", seat_class=r.seat_class, occupied_legs=legs))
+                # A hold that lapsed since the last sweep is already free to allocate
+                elif r.status == "HELD" and (r.hold_expires_at is None or r.hold_expires_at < now):
+                    seats.append(Seat(seat_no=r.seat_no, status="AVAILABLE", seat_class=r.seat_class))
+                else:
+                    seats.append(Seat(seat_no=r.seat_no, status=r.status, hold_expires_at=r.hold_expires_at, seat_class=r.seat_class))
+            return seats
 
     @app.post("/trips/{trip_id}/seats/allocate", response_model=Seat)
     def allocate_seat(trip_id: int, hold_minutes: int = 15) -> Seat:
         now = datetime.utcnow()
+        hold_until = now + timedelta(minutes=hold_minutes)
         with SessionLocal() as session:
-            # Try to pick an AVAILABLE or expired HELD seat
-            row = (
-                session.execute(
-                    select(SeatORM)
-                    .where(
-                        SeatORM.trip_id == trip_id,
-                        and_(
-                            (SeatORM.status == "AVAILABLE") |
-                            ((SeatORM.status == "HELD") & ((SeatORM.hold_expires_at == None) | (SeatORM.hold_expires_at < now)))
-                        ),
+            # Prefer never-held seats, then reclaim expired holds. Zero rows
+            # updated while seats remain means another worker won the row: retry.
+            for _ in range(SEAT_CLAIM_RETRIES):
+                claimed = claim_seat(session, trip_id, seat_is_available(), status="HELD", hold_expires_at=hold_until)
+                if claimed is not None:
+                    adjust_availability(session, trip_id, available=-1, held=1)
+                else:
+                    claimed = claim_seat(session, trip_id, seat_hold_lapsed(now), status="HELD", hold_expires_at=hold_until)
+                if claimed is not None:
+                    session.commit()
+                    hold_expiry.push(claimed.id, claimed.hold_expires_at)
+                    return Seat(seat_no=claimed.seat_no, status="HELD", hold_expires_at=claimed.hold_expires_at)
+                session.rollback()
+                remaining = session.execute(
+                    select(func.count(SeatORM.id)).where(
+                        SeatORM.trip_id == trip_id, seat_is_available() | seat_hold_lapsed(now)
                     )
-                    .order_by(SeatORM.id)
+                ).scalar_one()
+                if not remaining:
+                    break
+            raise HTTPException(status_code=409, detail="No seats available")
+
+    @app.post("/trips/{trip_id}/seats/allocate/group", response_model=List[Seat])
+    def allocate_seat_group(trip_id: int, count: int = Query(..., ge=1, le=50), hold_minutes: int = 15) -> List[Seat]:
+        now = datetime.utcnow()
+        hold_until = now + timedelta(minutes=hold_minutes)
+        claimable = seat_is_available() | seat_hold_lapsed(now)
+        with SessionLocal() as session:
+            # All-or-nothing: hold the whole block in one transaction, or nothing
+            for _ in range(SEAT_CLAIM_RETRIES):
+                free_ids = session.execute(
+                    select(SeatORM.id).where(SeatORM.trip_id == trip_id, claimable).order_by(SeatORM.id)
+                ).scalars().all()
+                if len(free_ids) < count:
+                    break
+                block = pick_seat_block(free_ids, count)
+                # Free seats and lapsed holds are claimed separately so the
+                # counters know how many seats actually left AVAILABLE
+                fresh, reclaimed = (
+                    session.execute(
+                        update(SeatORM)
+                        .where(SeatORM.id.in_(block), predicate)
+                        .values(status="HELD", hold_expires_at=hold_until)
+                        .returning(SeatORM.id, SeatORM.seat_no)
+                        .execution_options(synchronize_session=False)
+                    ).all()
+                    for predicate in (seat_is_available(), seat_hold_lapsed(now))
                 )
-                .scalars()
-                .first()
-            )
-            if not row:
-                raise HTTPException(status_code=409, detail="No seats available")
-            row.status = "HELD"
-            row.hold_expires_at = now + timedelta(minutes=hold_minutes)
-            session.commit()
-            return Seat(seat_no=row.seat_no, status=row.status, hold_expires_at=row.hold_expires_at)
+                claimed = fresh + reclaimed
+                if len(claimed) == count:
+                    adjust_availability(session, trip_id, available=-len(fresh), held=len(fresh))
+                    session.commit()
+                    for r in claimed:
+                        hold_expiry.push(r.id, hold_until)
+                    seat_no_by_id = {r.id: r.seat_no for r in claimed}
+                    return [Seat(seat_no=seat_no_by_id[i], status="HELD", hold_expires_at=hold_until) for i in block]
+                # Part of the block was taken concurrently: undo and pick again
+                session.rollback()
+            raise HTTPException(status_code=409, detail="Not enough seats available")
 
     @app.post("/trips/{trip_id}/seats/{seat_no}/confirm", response_model=Seat)
     def confirm_seat(trip_id: int, seat_no: str) -> Seat:
@@ -222,10 +1126,244 @@ def create_app() -> FastAPI:
                 raise HTTPException(status_code=404, detail="Seat not found")
             if row.status not in ("HELD", "AVAILABLE"):
                 raise HTTPException(status_code=409, detail="Seat not confirmable")
-            row.status = "SOLD"
-            row.hold_expires_at = None
+            # Only sell the seat in the state we just read, so the counter
+            # moved out of the right bucket
+            previous = row.status
+            result = session.execute(
+                update(SeatORM)
+                .where(SeatORM.id == row.id, SeatORM.status == previous, SeatORM.segment_mask == 0)
+                .values(status="SOLD", hold_expires_at=None)
+                .execution_options(synchronize_session=False)
+            )
+            if result.rowcount != 1:
+                session.rollback()
+                raise HTTPException(status_code=409, detail="Seat not confirmable")
+            if previous == "HELD":
+                adjust_availability(session, trip_id, held=-1, sold=1)
+            else:
+                adjust_availability(session, trip_id, available=-1, sold=1)
+            session.commit()
+            return Seat(seat_no=seat_no, status="SOLD")
+
+    @app.post("/trips/{trip_id}/seats/sell", response_model=Seat)
+    def sell_seat(trip_id: int, reference: str = Query(..., min_length=1, max_length=26)) -> Seat:
+        # Allocate and confirm in one call, tagged with the caller's booking
+        # reference. Retrying with the same reference returns the seat already
+        # sold to it instead of selling a second one.
+        now = datetime.utcnow()
+        with SessionLocal() as session:
+            for _ in range(SEAT_CLAIM_RETRIES):
+                sold = session.execute(
+                    select(SeatORM.seat_no).where(SeatORM.trip_id == trip_id, SeatORM.booking_ref == reference)
+                ).scalar_one_or_none()
+                if sold is not None:
+                    return Seat(seat_no=sold, status="SOLD")
+                values = dict(status="SOLD", hold_expires_at=None, booking_ref=reference)
+                claimed = claim_seat(session, trip_id, seat_is_available(), **values)
+                if claimed is not None:
+                    adjust_availability(session, trip_id, available=-1, sold=1)
+                else:
+                    claimed = claim_seat(session, trip_id, seat_hold_lapsed(now), **values)
+                    if claimed is not None:
+                        adjust_availability(session, trip_id, held=-1, sold=1)
+                if claimed is not None:
+                    session.commit()
+                    return Seat(seat_no=claimed.seat_no, status="SOLD")
+                session.rollback()
+                remaining = session.execute(
+                    select(func.count(SeatORM.id)).where(
+                        SeatORM.trip_id == trip_id, seat_is_available() | seat_hold_lapsed(now)
+                    )
+                ).scalar_one()
+                if not remaining:
+                    break
+            raise HTTPException(status_code=409, detail="No seats available")
+
+    @app.post("/trips/{trip_id}/seats/release", response_model=List[Seat])
+    def release_seat(trip_id: int, reference: str = Query(..., min_length=1, max_length=26)) -> List[Seat]:
+        # Compensation for a booking that failed after /seats/sell: seats sold
+        # under that reference go back on sale. Releasing twice is a no-op.
+        with SessionLocal() as session:
+            released = session.execute(
+                update(SeatORM)
+                .where(SeatORM.trip_id == trip_id, SeatORM.booking_ref == reference, SeatORM.status == "SOLD")
+                .values(status="AVAILABLE", hold_expires_at=None, booking_ref=None)
+                .returning(SeatORM.seat_no)
+                .execution_options(synchronize_session=False)
+            ).scalars().all()
+            if released:
+                adjust_availability(session, trip_id, available=len(released), sold=-len(released))
+            session.commit()
+            return [Seat(seat_no=seat_no, status="AVAILABLE") for seat_no in released]
+
+    def trip_stop_ids(session, trip_id: int) -> List[int]:
+        trip = session.get(TripORM, trip_id)
+        if trip is None:
+            raise HTTPException(status_code=404, detail="Trip not found")
+        stops = session.execute(
+            select(TripStopORM.station_id).where(TripStopORM.trip_id == trip_id).order_by(TripStopORM.seq)
+        ).scalars().all()
+        return list(stops) or [trip.origin_station_id, trip.destination_station_id]
+
+    @app.get("/trips/{trip_id}/stops", response_model=TripStops)
+    def get_trip_stops(trip_id: int) -> TripStops:
+        with SessionLocal() as session:
+            return TripStops(station_ids=trip_stop_ids(session, trip_id))
+
+    @app.put("/trips/{trip_id}/stops", response_model=TripStops)
+    def set_trip_stops(trip_id: int, body: TripStops) -> TripStops:
+        with SessionLocal() as session:
+            trip = session.get(TripORM, trip_id)
+            if trip is None:
+                raise HTTPException(status_code=404, detail="Trip not found")
+            if body.station_ids[0] != trip.origin_station_id or body.station_ids[-1] != trip.destination_station_id:
+                raise HTTPException(status_code=400, detail="Stops must start at the trip origin and end at its destination")
+            known = set(session.execute(
+                select(StationORM.id).where(StationORM.id.in_(body.station_ids))
+            ).scalars())
+            if known != set(body.station_ids):
+                raise HTTPException(status_code=400, detail="Invalid station id")
+            # Leg bits are positional: renumbering stops under live bookings would corrupt them
+            booked = session.execute(
+                select(SeatSegmentORM.id).where(
+                    SeatSegmentORM.trip_id == trip_id, SeatSegmentORM.status.in_(("HELD", "SOLD"))
+                ).limit(1)
+            ).first()
+            if booked:
+                raise HTTPException(status_code=409, detail="Trip has segment bookings")
+            session.query(TripStopORM).filter(TripStopORM.trip_id == trip_id).delete()
+            session.execute(
+                insert(TripStopORM),
+                [{"trip_id": trip_id, "seq": seq, "station_id": sid} for seq, sid in enumerate(body.station_ids)],
+            )
             session.commit()
-            return Seat(seat_no=row.seat_no, status=row.status)
+            return body
+
+    @app.post("/trips/{trip_id}/segments/allocate", response_model=SeatSegment)
+    def allocate_segment(trip_id: int, from_station_id: int, to_station_id: int, hold_minutes: int = 15) -> SeatSegment:
+        now = datetime.utcnow()
+        hold_until = now + timedelta(minutes=hold_minutes)
+        with SessionLocal() as session:
+            stops = trip_stop_ids(session, trip_id)
+            try:
+                from_seq = stops.index(from_station_id)
+                to_seq = stops.index(to_station_id, from_seq + 1)
+            except ValueError:
+                raise HTTPException(status_code=400, detail="Stations are not an ordered leg range of this trip")
+            leg_mask = leg_range_mask(from_seq, to_seq)
+            for _ in range(SEAT_CLAIM_RETRIES):
+                candidates = session.execute(
+                    select(SeatORM.id, SeatORM.segment_mask)
+                    .where(
+                        SeatORM.trip_id == trip_id,
+                        SeatORM.status == "AVAILABLE",
+                        SeatORM.segment_mask.op("&")(leg_mask) == 0,
+                    )
+                    .order_by(SeatORM.id)
+                ).all()
+                picked = pick_segment_seat(candidates, leg_mask)
+                if picked is None:
+                    break
+                seat_id, mask = picked
+                # Compare-and-set on the mask we read: a concurrent booking on
+                # the same seat makes this update zero rows
+                result = session.execute(
+                    update(SeatORM)
+                    .where(SeatORM.id == seat_id, SeatORM.status == "AVAILABLE", SeatORM.segment_mask == mask)
+                    .values(segment_mask=mask | leg_mask)
+                    .execution_options(synchronize_session=False)
+                )
+                if result.rowcount != 1:
+                    session.rollback()
+                    continue
+                if mask == 0:
+                    # First segment on this seat: no longer sellable end to end
+                    adjust_availability(session, trip_id, available=-1, partial=1)
+                row = SeatSegmentORM(
+                    seat_id=seat_id,
+                    trip_id=trip_id,
+                    from_seq=from_seq,
+                    to_seq=to_seq,
+                    leg_mask=leg_mask,
+                    status="HELD",
+                    hold_expires_at=hold_until,
+                )
+                session.add(row)
+                session.commit()
+                seat_no = session.execute(select(SeatORM.seat_no).where(SeatORM.id == seat_id)).scalar_one()
+                return SeatSegment(
+                    id=row.id,
+                    seat_no=seat_no,
+                    from_station_id=from_station_id,
+                    to_station_id=to_station_id,
+                    status="HELD",
+                    hold_expires_at=hold_until,
+                )
+            raise HTTPException(status_code=409, detail="No seats available on this segment")
+
+    @app.post("/trips/{trip_id}/segments/{segment_id}/confirm", response_model=SeatSegment)
+    def confirm_segment(trip_id: int, segment_id: int) -> SeatSegment:
+        with SessionLocal() as session:
+            result = session.execute(
+                update(SeatSegmentORM)
+                .where(
+                    SeatSegmentORM.id == segment_id,
+                    SeatSegmentORM.trip_id == trip_id,
+                    SeatSegmentORM.status.in_(("HELD", "SOLD")),
+                )
+                .values(status="SOLD", hold_expires_at=None)
+                .returning(SeatSegmentORM.seat_id, SeatSegmentORM.from_seq, SeatSegmentORM.to_seq)
+                .execution_options(synchronize_session=False)
+            ).first()
+            if result is None:
+                raise HTTPException(status_code=409, detail="Segment not confirmable")
+            session.commit()
+            stops = trip_stop_ids(session, trip_id)
+            seat_no = session.execute(select(SeatORM.seat_no).where(SeatORM.id == result.seat_id)).scalar_one()
+            return SeatSegment(
+                id=segment_id,
+                seat_no=seat_no,
+                from_station_id=stops[result.from_seq],
+                to_station_id=stops[result.to_seq],
+                status="SOLD",
+            )
+
+    @app.get("/trips/availability", response_model=List[Availability])
+    def list_availability(trip_ids: List[int] = Query(..., alias="trip_id")) -> List[Availability]:
+        # One indexed read for a whole search page: ?trip_id=1&trip_id=2...
+        with SessionLocal() as session:
+            rows = session.execute(
+                select(TripAvailabilityORM).where(TripAvailabilityORM.trip_id.in_(trip_ids))
+            ).scalars().all()
+            return [availability_out(r) for r in rows]
+
+    @app.get("/trips/{trip_id}/availability", response_model=Availability)
+    def get_availability(trip_id: int) -> Availability:
+        with SessionLocal() as session:
+            row = session.get(TripAvailabilityORM, trip_id)
+            if row is None:
+                if session.get(TripORM, trip_id) is None:
+                    raise HTTPException(status_code=404, detail="Trip not found")
+                return Availability(trip_id=trip_id, available=0, held=0, sold=0)
+            return availability_out(row)
+
+    # Registered last so /trips/search and /trips/availability match first
+    @app.get("/trips/{trip_id}", response_model=Trip)
+    def get_trip(trip_id: int, request: Request):
+        def load():
+            with SessionLocal() as session:
+                row = session.get(TripORM, trip_id)
+                if row is None:
+                    raise HTTPException(status_code=404, detail="Trip not found")
+                return Trip(
+                    id=row.id,
+                    origin_station_id=row.origin_station_id,
+                    destination_station_id=row.destination_station_id,
+                    departure_time=row.departure_time,
+                    arrival_time=row.arrival_time,
+                )
+
+        return cached_json(request, read_cache, f"trips/{trip_id}", load)
 
     return app
 
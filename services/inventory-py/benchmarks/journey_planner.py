@@ -0,0 +1,120 @@
+"""Journey planner benchmark on a synthetic timetable.
+
+    python benchmarks/journey_planner.py [--stations 200] [--trips 300000] [--days 90]
+
+Writes the timetable to a throwaway SQLite database, then times the cold
+load a fresh worker does on its first /journeys (sync from the database),
+an incremental add, Connection Scan queries in process and the endpoint
+end to end.
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+DB_DIR = tempfile.mkdtemp()
+os.environ["INVENTORY_DATABASE_URL"] = f"sqlite:///{DB_DIR}/journeys.db"
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from fastapi.testclient import TestClient  # noqa: E402
+from sqlalchemy import create_engine, insert  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+
+from app.main import JourneyPlanner, StationORM, TripORM, create_app, to_epoch  # noqa: E402
+
+START = datetime(2030, 1, 1)
+
+
+def percentiles(samples: list) -> str:
+    ordered = sorted(samples)
+    return f"p50 {ordered[len(ordered) // 2] * 1000:.1f}ms  p99 {ordered[int(len(ordered) * 0.99)] * 1000:.1f}ms"
+
+
+def generate(session, stations: int, trips: int, days: int, rng: random.Random) -> None:
+    session.execute(insert(StationORM), [
+        {"id": i, "name": f"Station {i}", "latitude": rng.uniform(-4, 2), "longitude": rng.uniform(9, 14)}
+        for i in range(1, stations + 1)
+    ])
+    rows = []
+    for _ in range(trips):
+        origin, destination = rng.sample(range(1, stations + 1), 2)
+        departure = START + timedelta(minutes=rng.randrange(days * 24 * 60))
+        rows.append({
+            "origin_station_id": origin,
+            "destination_station_id": destination,
+            "departure_time": departure,
+            "arrival_time": departure + timedelta(minutes=rng.randrange(30, 600)),
+        })
+    session.execute(insert(TripORM), rows)
+    session.commit()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--stations", type=int, default=200)
+    parser.add_argument("--trips", type=int, default=300_000)
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    app = create_app()
+    session_factory = sessionmaker(bind=create_engine(os.environ["INVENTORY_DATABASE_URL"]))
+
+    started = time.perf_counter()
+    with session_factory() as session:
+        generate(session, args.stations, args.trips, args.days, rng)
+    print(f"timetable   {args.trips} trips, {args.stations} stations, {args.days} days "
+          f"(generated in {time.perf_counter() - started:.1f}s)")
+
+    planner = JourneyPlanner()
+    with session_factory() as session:
+        started = time.perf_counter()
+        planner.sync(session)
+        print(f"cold sync   {time.perf_counter() - started:.2f}s for {len(planner)} connections")
+        session.execute(insert(TripORM), [{
+            "origin_station_id": 1, "destination_station_id": 2,
+            "departure_time": START, "arrival_time": START + timedelta(hours=1),
+        }])
+        session.commit()
+        started = time.perf_counter()
+        planner.sync(session)
+        print(f"incremental {(time.perf_counter() - started) * 1000:.1f}ms for one new trip")
+
+    queries = []
+    for _ in range(args.queries):
+        origin, destination = rng.sample(range(1, args.stations + 1), 2)
+        queries.append((origin, destination, START + timedelta(days=rng.randrange(max(1, args.days - 3)))))
+
+    samples = []
+    for origin, destination, depart_after in queries:
+        started = time.perf_counter()
+        planner.plan(origin, destination, to_epoch(depart_after), 3, 600, 48 * 3600)
+        samples.append(time.perf_counter() - started)
+    print(f"plan        {percentiles(samples)}  (in process, max 3 legs, 48h horizon)")
+
+    def timed_request(client, origin: int, destination: int, depart_after: datetime) -> float:
+        started = time.perf_counter()
+        client.get("/journeys", params={
+            "origin_station_id": origin,
+            "destination_station_id": destination,
+            "depart_after": depart_after.isoformat(),
+        }).raise_for_status()
+        return time.perf_counter() - started
+
+    with TestClient(app) as client:
+        # The app's own planner loads the timetable on its first request
+        print(f"/journeys   first call {timed_request(client, *queries[0]):.2f}s")
+        samples = [timed_request(client, *query) for query in queries]
+    print(f"/journeys   {percentiles(samples)}  (TestClient)")
+
+
+if __name__ == "__main__":
+    main()
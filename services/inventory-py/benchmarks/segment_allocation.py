@@ -0,0 +1,90 @@
+"""Segment allocation benchmark on a trip with many stops.
+
+    python benchmarks/segment_allocation.py [--stops 40] [--seats 300] [--requests 2000]
+
+Books random leg ranges (1 to --max-legs legs) through
+POST /trips/{id}/segments/allocate until --requests have been made, then
+reports the allocation rate, how tightly the bookings were packed, and
+the raw rate of the in-process best-fit pick.
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+os.environ["INVENTORY_DATABASE_URL"] = f"sqlite:///{tempfile.mkdtemp()}/segments.db"
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+from app.main import create_app, leg_range_mask, pick_segment_seat  # noqa: E402
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--stops", type=int, default=40)
+    parser.add_argument("--seats", type=int, default=300)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--max-legs", type=int, default=7)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    def leg_range() -> tuple:
+        start = rng.randrange(args.stops - 1)
+        return start, rng.randrange(start + 1, min(args.stops, start + args.max_legs + 1))
+
+    with TestClient(create_app()) as client:
+        stops = [
+            client.post("/stations", json={"name": f"Stop {i}", "latitude": 0.0, "longitude": 9.0 + i / 100}).json()["id"]
+            for i in range(args.stops)
+        ]
+        trip_id = client.post("/trips", json={
+            "origin_station_id": stops[0],
+            "destination_station_id": stops[-1],
+            "departure_time": "2030-01-01T06:00:00",
+            "arrival_time": "2030-01-01T20:00:00",
+        }).json()["id"]
+        client.post(f"/trips/{trip_id}/seats/seed", params={"count": args.seats})
+        client.put(f"/trips/{trip_id}/stops", json={"station_ids": stops}).raise_for_status()
+
+        booked = legs = 0
+        started = time.perf_counter()
+        for _ in range(args.requests):
+            from_seq, to_seq = leg_range()
+            response = client.post(f"/trips/{trip_id}/segments/allocate", params={
+                "from_station_id": stops[from_seq], "to_station_id": stops[to_seq],
+            })
+            if response.status_code == 200:
+                booked += 1
+                legs += to_seq - from_seq
+        elapsed = time.perf_counter() - started
+        counts = client.get(f"/trips/{trip_id}/availability").json()
+
+    print(f"trip        {args.stops} stops ({args.stops - 1} legs), {args.seats} seats")
+    print(f"/allocate   {args.requests / elapsed:.0f} requests/s (TestClient), {booked} booked, "
+          f"{args.requests - booked} refused")
+    print(f"packing     {counts['partial']} seats carry segments, {counts['available']} untouched, "
+          f"{legs / max(1, counts['partial'] * (args.stops - 1)):.0%} of their legs used")
+
+    seats = [(seat_id, 0) for seat_id in range(args.seats)]
+    picks = 0
+    started = time.perf_counter()
+    while time.perf_counter() - started < 1.0:
+        leg_mask = leg_range_mask(*leg_range())
+        picked = pick_segment_seat(seats, leg_mask)
+        if picked is None:
+            seats = [(seat_id, 0) for seat_id in range(args.seats)]
+            continue
+        seats[picked[0]] = (picked[0], picked[1] | leg_mask)
+        picks += 1
+    print(f"best fit    {picks / (time.perf_counter() - started):.0f} picks/s in process over {args.seats} seats")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+import os
+import tempfile
+
+import pytest
+from fastapi.testclient import TestClient
+
+# Before app.main is imported: its module-level app must not touch ./inventory.db
+os.environ["INVENTORY_DATABASE_URL"] = f"sqlite:///{tempfile.mkdtemp()}/import.db"
+
+from app.main import create_app  # noqa: E402
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setenv("INVENTORY_DATABASE_URL", f"sqlite:///{tmp_path}/inventory.db")
+    monkeypatch.setenv("INVENTORY_HOLD_SWEEP_SECONDS", "0.05")
+    with TestClient(create_app()) as client:
+        yield client
+
+
+@pytest.fixture
+def make_trip(client):
+    def make_trip(station_count: int = 2, seats: int = 10) -> tuple:
+        # (trip_id, [station ids in calling order])
+        station_ids = [
+            client.post("/stations", json={"name": f"S{i}", "latitude": 0.1 * i, "longitude": 9.0 + 0.1 * i}).json()["id"]
+            for i in range(station_count)
+        ]
+        trip = client.post("/trips", json={
+            "origin_station_id": station_ids[0],
+            "destination_station_id": station_ids[-1],
+            "departure_time": "2030-01-01T08:00:00",
+            "arrival_time": "2030-01-01T20:00:00",
+        }).json()
+        client.post(f"/trips/{trip['id']}/seats/seed", params={"count": seats})
+        if station_count > 2:
+            client.put(f"/trips/{trip['id']}/stops", json={"station_ids": station_ids})
+        return trip["id"], station_ids
+
+    return make_trip
@@ -0,0 +1,59 @@
+from fastapi.testclient import TestClient
+
+from app.main import create_app
+
+
+def add_trip(client, origin: int, destination: int, departure: str, arrival: str) -> int:
+    return client.post("/trips", json={
+        "origin_station_id": origin,
+        "destination_station_id": destination,
+        "departure_time": f"2030-01-01T{departure}:00",
+        "arrival_time": f"2030-01-01T{arrival}:00",
+    }).json()["id"]
+
+
+def journeys(client, origin: int, destination: int, depart_after: str = "2030-01-01T00:00:00", **params) -> list:
+    response = client.get("/journeys", params={
+        "origin_station_id": origin, "destination_station_id": destination, "depart_after": depart_after, **params,
+    })
+    assert response.status_code == 200
+    return [[leg["id"] for leg in journey["legs"]] for journey in response.json()]
+
+
+def stations(client, count: int) -> list:
+    return [
+        client.post("/stations", json={"name": f"S{i}", "latitude": 0.0, "longitude": 9.0}).json()["id"]
+        for i in range(count)
+    ]
+
+
+def test_pareto_set_over_arrival_and_transfers(client):
+    a, b, c = stations(client, 3)
+    direct = add_trip(client, a, c, "06:00", "20:00")
+    first = add_trip(client, a, b, "07:00", "09:00")
+    tight = add_trip(client, b, c, "09:05", "12:00")
+    second = add_trip(client, b, c, "09:30", "14:00")
+    assert journeys(client, a, c) == [[direct], [first, second]]
+    assert journeys(client, a, c, min_transfer_minutes=0) == [[direct], [first, tight]]
+    assert journeys(client, c, a) == []
+
+
+def test_timezone_aware_depart_after(client):
+    a, b = stations(client, 2)
+    trip = add_trip(client, a, b, "08:00", "10:00")
+    assert journeys(client, a, b, depart_after="2030-01-01T07:00:00Z") == [[trip]]
+    # 09:00+02:00 is 07:00 UTC; 11:00+02:00 is past the 08:00 UTC departure
+    assert journeys(client, a, b, depart_after="2030-01-01T09:00:00+02:00") == [[trip]]
+    assert journeys(client, a, b, depart_after="2030-01-01T11:00:00+02:00") == []
+
+
+def test_trips_from_before_a_restart_are_planned(tmp_path, monkeypatch):
+    monkeypatch.setenv("INVENTORY_DATABASE_URL", f"sqlite:///{tmp_path}/restart.db")
+    with TestClient(create_app()) as client:
+        a, b = stations(client, 2)
+        existing = add_trip(client, a, b, "08:00", "10:00")
+    with TestClient(create_app()) as client:
+        # Creating a trip before any planning must not hide the older ones
+        later = add_trip(client, a, b, "12:00", "14:00")
+        assert journeys(client, a, b) == [[existing]]
+        assert journeys(client, a, b, depart_after="2030-01-01T11:00:00") == [[later]]
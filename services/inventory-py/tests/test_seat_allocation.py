@@ -0,0 +1,41 @@
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+
+def test_allocate_holds_each_seat_once(client, make_trip):
+    trip_id, _ = make_trip(seats=3)
+    seats = [client.post(f"/trips/{trip_id}/seats/allocate").json()["seat_no"] for _ in range(3)]
+    assert sorted(seats) == ["1A", "2A", "3A"]
+    assert client.post(f"/trips/{trip_id}/seats/allocate").status_code == 409
+    assert client.get(f"/trips/{trip_id}/availability").json() == {"trip_id": trip_id, "available": 0, "held": 3, "sold": 0, "partial": 0}
+
+
+def test_allocate_reclaims_lapsed_holds(client, make_trip):
+    trip_id, _ = make_trip(seats=1)
+    assert client.post(f"/trips/{trip_id}/seats/allocate", params={"hold_minutes": 0}).status_code == 200
+    time.sleep(0.01)
+    assert client.post(f"/trips/{trip_id}/seats/allocate").json()["seat_no"] == "1A"
+
+
+def test_concurrent_allocation_never_double_holds(client, make_trip):
+    # Sales rush on one trip: more requests than seats from many threads
+    seats, requests, threads = 200, 240, 16
+    trip_id, _ = make_trip(seats=seats)
+
+    def allocate(_):
+        response = client.post(f"/trips/{trip_id}/seats/allocate")
+        return response.status_code, response.json().get("seat_no")
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(threads) as pool:
+        results = list(pool.map(allocate, range(requests)))
+    elapsed = time.perf_counter() - started
+
+    held = [seat_no for status, seat_no in results if status == 200]
+    duplicates = [seat_no for seat_no, n in Counter(held).items() if n > 1]
+    print(f"\n{len(held)} holds from {threads} threads in {elapsed:.2f}s ({len(held) / elapsed:.0f} allocations/s)")
+    assert duplicates == []
+    assert len(held) == seats
+    assert Counter(status for status, _ in results) == {200: seats, 409: requests - seats}
+    assert client.get(f"/trips/{trip_id}/availability").json()["held"] == seats
@@ -0,0 +1,135 @@
+import sqlite3
+import time
+
+import app.main
+from app.main import leg_range_mask, pick_segment_seat
+
+
+def seat_masks(tmp_path, trip_id: int) -> dict:
+    with sqlite3.connect(tmp_path / "inventory.db") as conn:
+        return dict(conn.execute("SELECT seat_no, segment_mask FROM seats WHERE trip_id = ? ORDER BY id", (trip_id,)))
+
+
+def allocate(client, trip_id: int, stops: list, from_seq: int, to_seq: int, **params):
+    return client.post(
+        f"/trips/{trip_id}/segments/allocate",
+        params={"from_station_id": stops[from_seq], "to_station_id": stops[to_seq], **params},
+    )
+
+
+def test_leg_range_mask():
+    assert leg_range_mask(0, 1) == 0b1
+    assert leg_range_mask(1, 3) == 0b110
+    assert leg_range_mask(2, 5) == 0b11100
+    assert leg_range_mask(0, 63) == (1 << 63) - 1
+
+
+def test_pick_segment_seat_best_fit():
+    legs = leg_range_mask(1, 2)
+    # Overlapping seats are skipped; among the rest the most used wins
+    assert pick_segment_seat([(1, 0b000), (2, 0b010), (3, 0b101)], legs) == (3, 0b101)
+    # Ties keep seat order
+    assert pick_segment_seat([(4, 0b001), (5, 0b100)], legs) == (4, 0b001)
+    assert pick_segment_seat([(1, 0b010), (2, 0b110)], legs) is None
+    assert pick_segment_seat([], legs) is None
+
+
+def test_disjoint_legs_share_a_seat(client, make_trip, tmp_path):
+    trip_id, stops = make_trip(station_count=4, seats=1)
+    first = allocate(client, trip_id, stops, 0, 1).json()
+    second = allocate(client, trip_id, stops, 1, 3).json()
+    assert first["seat_no"] == second["seat_no"] == "1A"
+    assert seat_masks(tmp_path, trip_id) == {"1A": 0b111}
+    # Overlapping legs and whole-trip sales find no seat
+    assert allocate(client, trip_id, stops, 0, 2).status_code == 409
+    assert client.post(f"/trips/{trip_id}/seats/allocate").status_code == 409
+
+
+def test_allocate_rejects_reversed_leg_range(client, make_trip):
+    trip_id, stops = make_trip(station_count=3)
+    assert allocate(client, trip_id, stops, 2, 0).status_code == 400
+
+
+def test_allocate_retries_when_mask_changed_underneath(client, make_trip, tmp_path, monkeypatch):
+    trip_id, stops = make_trip(station_count=3, seats=2)
+    picks = []
+
+    def racing_pick(candidates, leg_mask):
+        picked = pick_segment_seat(candidates, leg_mask)
+        if not picks:
+            # Another worker books the same legs on this seat between the
+            # read and the compare-and-set
+            with sqlite3.connect(tmp_path / "inventory.db") as conn:
+                conn.execute("UPDATE seats SET segment_mask = segment_mask | ? WHERE id = ?", (leg_mask, picked[0]))
+        picks.append(picked)
+        return picked
+
+    monkeypatch.setattr(app.main, "pick_segment_seat", racing_pick)
+    segment = allocate(client, trip_id, stops, 0, 2).json()
+    assert len(picks) == 2
+    assert segment["seat_no"] == "2A"
+    assert seat_masks(tmp_path, trip_id) == {"1A": 0b11, "2A": 0b11}
+
+
+def test_expired_segment_clears_only_its_own_bits(client, make_trip, tmp_path):
+    trip_id, stops = make_trip(station_count=4, seats=1)
+    assert allocate(client, trip_id, stops, 0, 1, hold_minutes=0).status_code == 200
+    kept = allocate(client, trip_id, stops, 2, 3).json()
+    assert client.post(f"/trips/{trip_id}/segments/{kept['id']}/confirm").json()["status"] == "SOLD"
+    assert seat_masks(tmp_path, trip_id) == {"1A": 0b101}
+
+    deadline = time.monotonic() + 5
+    while seat_masks(tmp_path, trip_id) != {"1A": 0b100} and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert seat_masks(tmp_path, trip_id) == {"1A": 0b100}
+    assert allocate(client, trip_id, stops, 0, 2).status_code == 200
+    assert allocate(client, trip_id, stops, 2, 3).status_code == 409
+
+
+def test_stops_are_frozen_under_live_segments(client, make_trip, tmp_path):
+    trip_id, stops = make_trip(station_count=4, seats=1)
+    reordered = {"station_ids": [stops[0], stops[2], stops[1], stops[3]]}
+    held = allocate(client, trip_id, stops, 0, 1, hold_minutes=0).json()
+    assert client.put(f"/trips/{trip_id}/stops", json=reordered).status_code == 409
+
+    deadline = time.monotonic() + 5
+    while seat_masks(tmp_path, trip_id) != {"1A": 0} and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert client.post(f"/trips/{trip_id}/segments/{held['id']}/confirm").status_code == 409
+    assert client.put(f"/trips/{trip_id}/stops", json=reordered).status_code == 200
+
+    sold = allocate(client, trip_id, reordered["station_ids"], 1, 3).json()
+    client.post(f"/trips/{trip_id}/segments/{sold['id']}/confirm")
+    assert client.put(f"/trips/{trip_id}/stops", json={"station_ids": stops}).status_code == 409
+
+
+def availability(client, trip_id: int) -> dict:
+    counts = client.get(f"/trips/{trip_id}/availability").json()
+    return {key: counts[key] for key in ("available", "held", "sold", "partial")}
+
+
+def test_partly_booked_seats_leave_available(client, make_trip, tmp_path):
+    trip_id, stops = make_trip(station_count=3, seats=2)
+    allocate(client, trip_id, stops, 0, 1, hold_minutes=0)
+    allocate(client, trip_id, stops, 0, 1)
+    # Both seats carry a segment: none can be sold end to end
+    assert availability(client, trip_id) == {"available": 0, "held": 0, "sold": 0, "partial": 2}
+    assert client.post(f"/trips/{trip_id}/seats/allocate").status_code == 409
+    seats = client.get(f"/trips/{trip_id}/seats").json()
+    assert [(s["status"], s["occupied_legs"]) for s in seats] == [("PARTIAL", [0]), ("PARTIAL", [0])]
+
+    # The expired hold frees its seat entirely: back to available
+    deadline = time.monotonic() + 5
+    while availability(client, trip_id)["partial"] != 1 and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert availability(client, trip_id) == {"available": 1, "held": 0, "sold": 0, "partial": 1}
+    assert client.post(f"/trips/{trip_id}/seats/allocate").json()["seat_no"] == "1A"
+    assert availability(client, trip_id) == {"available": 0, "held": 1, "sold": 0, "partial": 1}
+
+
+def test_second_segment_on_a_seat_keeps_one_partial(client, make_trip):
+    trip_id, stops = make_trip(station_count=3, seats=1)
+    allocate(client, trip_id, stops, 0, 1)
+    allocate(client, trip_id, stops, 1, 2)
+    assert availability(client, trip_id) == {"available": 0, "held": 0, "sold": 0, "partial": 1}
+    assert client.get(f"/trips/{trip_id}/seats").json()[0]["occupied_legs"] == [0, 1]
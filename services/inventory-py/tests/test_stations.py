@@ -0,0 +1,60 @@
+import threading
+
+from fastapi.testclient import TestClient
+
+from app.main import StationSpatialIndex, create_app
+
+
+class Row:
+    def __init__(self, id: int, latitude: float, longitude: float) -> None:
+        self.id, self.name, self.latitude, self.longitude = id, f"S{id}", latitude, longitude
+
+
+def test_nearest_and_within(client):
+    ids = {
+        name: client.post("/stations", json={"name": name, "latitude": lat, "longitude": lon}).json()["id"]
+        for name, lat, lon in (
+            ("Libreville", 0.39, 9.45), ("Owendo", 0.29, 9.50), ("Franceville", -1.63, 13.58), ("Fidji", -17.7, 179.9),
+        )
+    }
+    nearest = client.get("/stations/nearest", params={"latitude": 0.39, "longitude": 9.45, "k": 2}).json()
+    assert [st["id"] for st in nearest] == [ids["Libreville"], ids["Owendo"]]
+    assert nearest[0]["distance_km"] == 0
+    box = client.get("/stations/within", params={
+        "min_latitude": -2, "min_longitude": 9, "max_latitude": 1, "max_longitude": 10,
+    }).json()
+    assert {st["id"] for st in box} == {ids["Libreville"], ids["Owendo"]}
+    # Box crossing the antimeridian
+    box = client.get("/stations/within", params={
+        "min_latitude": -20, "min_longitude": 179, "max_latitude": -15, "max_longitude": -179,
+    }).json()
+    assert [st["id"] for st in box] == [ids["Fidji"]]
+
+
+def test_existing_stations_survive_a_restart_and_a_new_station(tmp_path, monkeypatch):
+    monkeypatch.setenv("INVENTORY_DATABASE_URL", f"sqlite:///{tmp_path}/restart.db")
+    with TestClient(create_app()) as client:
+        existing = client.post("/stations", json={"name": "A", "latitude": 0.4, "longitude": 9.4}).json()["id"]
+    with TestClient(create_app()) as client:
+        client.post("/stations", json={"name": "N", "latitude": 5.0, "longitude": 5.0})
+        nearest = client.get("/stations/nearest", params={"latitude": 0.4, "longitude": 9.4, "k": 1}).json()
+        assert [st["id"] for st in nearest] == [existing]
+
+
+def test_within_never_mixes_snapshots():
+    # Stations keep arriving south of the box while it is queried: every
+    # answer must come from one consistent snapshot
+    index = StationSpatialIndex()
+    index.add([Row(1, 0.5, 9.5)])
+    done = threading.Event()
+
+    def writer() -> None:
+        for i in range(2, 400):
+            index.add([Row(i, -10.0 - i / 100, 9.5)])
+        done.set()
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    while not done.is_set():
+        assert [st[0] for st in index.within(0.0, 9.0, 1.0, 10.0)] == [1]
+    thread.join()
@@ -1,16 +1,26 @@
 from __future__ import annotations
 
+import asyncio
+import base64
+import hashlib
+import json
 import os
+import threading
+import time
+from collections import Counter, OrderedDict, deque
+from contextlib import contextmanager
 from datetime import datetime
-from typing import Optional
+from typing import Awaitable, Callable, Deque, Dict, List, Literal, Optional, Tuple
 
 import httpx
-from fastapi import FastAPI, HTTPException, Depends, status
+from fastapi import FastAPI, HTTPException, Depends, Query, Response, status
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import OAuth2PasswordBearer
+from starlette.concurrency import run_in_threadpool
 import jwt
-from pydantic import BaseModel
-from sqlalchemy import Column, DateTime, Float, Integer, String, create_engine, select, UniqueConstraint
+from pydantic import BaseModel, Field
+from sqlalchemy import Column, DateTime, Float, Index, Integer, String, and_, create_engine, func, insert, inspect, or_, select, text, UniqueConstraint
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import declarative_base, sessionmaker
 from ulid import ULID
 
@@ -29,13 +39,523 @@ class BookingORM(Base):
     status = Column(String(16), nullable=False, default="CONFIRMED")
     idempotency_key = Column(String(64), nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
+    # "sub" du jeton users ; NULL pour les réservations antérieures
+    user_id = Column(Integer, nullable=True)
     __table_args__ = (UniqueConstraint('idempotency_key', name='uq_idempotency_key'),)
 
 
+# Historique d'un client, du plus récent au plus ancien (pagination par curseur)
+Index("ix_bookings_user_created", BookingORM.user_id, BookingORM.created_at, BookingORM.id)
+
+
+class FareORM(Base):
+    # Prix de base 2ème classe par couple de gares (identifiants inventory-py)
+    __tablename__ = "fares"
+    origin_station_id = Column(Integer, primary_key=True)
+    destination_station_id = Column(Integer, primary_key=True)
+    base_price = Column(Float, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+
+
+# Prix appliqué quand la route n'a pas de tarif ou qu'inventory-py ne répond pas
+DEFAULT_BASE_PRICE = 10000.0
+
+# Tarifs historiques, insérés (par nom de gare) si la table fares est vide
+DEFAULT_ROUTE_FARES = {
+    ("Libreville", "Franceville"): 25000.0,
+    ("Franceville", "Libreville"): 25000.0,
+    ("Libreville", "Moanda"): 15000.0,
+    ("Moanda", "Libreville"): 15000.0,
+    ("Libreville", "Owendo"): 5000.0,
+    ("Owendo", "Libreville"): 5000.0,
+}
+
+# Coefficients appliqués au tarif de la route. Différent de PricingService
+# (Laravel), qui facture le VIP à un prix fixe par route (45000 à 100000) et
+# calcule la commission avant la réduction passager.
+CLASS_MULTIPLIERS = {
+    "second_class": 1.0,
+    "first_class": 1.5,
+    "VIP": 2.0,
+}
+PASSENGER_MULTIPLIERS = {
+    "adult": 1.0,
+    "student": 0.9,
+    "senior": 0.7,
+    "child": 0.0,
+}
+
+
+class VerifiedTokenCache:
+    # Charges utiles des jetons déjà vérifiés (HMAC), indexées par SHA-256 du
+    # jeton et oubliées à leur exp (au plus tard après max_ttl_seconds).
+    # LRU borné, partagé par les threads du threadpool.
+
+    def __init__(self, max_entries: int = 10000, max_ttl_seconds: float = 300.0) -> None:
+        self.max_entries = max_entries
+        self.max_ttl_seconds = max_ttl_seconds
+        self._entries: "OrderedDict[bytes, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token: str) -> Optional[dict]:
+        key = hashlib.sha256(token.encode()).digest()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, token: str, payload: dict) -> None:
+        expires_at = time.time() + self.max_ttl_seconds
+        if isinstance(payload.get("exp"), (int, float)):
+            expires_at = min(expires_at, payload["exp"])
+        key = hashlib.sha256(token.encode()).digest()
+        with self._lock:
+            self._entries[key] = (expires_at, payload)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class FareMatrix:
+    # Matrice des tarifs en mémoire, lookup O(1) par (origine, destination).
+    # Rechargée à chaud : le dictionnaire est reconstruit puis remplacé d'un bloc,
+    # les lectures concurrentes voient l'ancienne ou la nouvelle matrice.
+
+    def __init__(self) -> None:
+        self._fares: Dict[tuple, float] = {}
+        self._signature: Optional[tuple] = None
+        self._lock = threading.Lock()
+
+    def lookup(self, origin_station_id: int, destination_station_id: int) -> float:
+        return self._fares.get((origin_station_id, destination_station_id), DEFAULT_BASE_PRICE)
+
+    def __len__(self) -> int:
+        return len(self._fares)
+
+    def reload(self, session, force: bool = False) -> bool:
+        # Signature (nombre de lignes, dernière modification) : on ne relit la
+        # table que si elle a changé depuis le dernier chargement
+        signature = tuple(session.execute(select(func.count(), func.max(FareORM.updated_at))).one())
+        if not force and signature == self._signature:
+            return False
+        rows = session.execute(
+            select(FareORM.origin_station_id, FareORM.destination_station_id, FareORM.base_price)
+        ).all()
+        with self._lock:
+            self._fares = {(o, d): price for o, d, price in rows}
+            self._signature = signature
+        return True
+
+
+class CircuitOpenError(Exception):
+    # Appel refusé sans contacter inventory-py (disjoncteur ouvert)
+    pass
+
+
+class CircuitBreaker:
+    # Disjoncteur autour d'inventory-py. Fermé : les appels passent, avec un
+    # délai maximal chacun. Après failure_threshold échecs consécutifs
+    # (erreur réseau, délai dépassé, 5xx) il s'ouvre et refuse tout pendant
+    # reset_seconds ; ensuite une seule requête sonde (semi-ouvert) décide
+    # de la refermeture ou d'une nouvelle ouverture.
+
+    def __init__(self, failure_threshold: int = 5, reset_seconds: float = 30.0, deadline_seconds: float = 2.0) -> None:
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.deadline_seconds = deadline_seconds
+        self.state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self.counters: Counter = Counter()
+
+    def _allow(self) -> bool:
+        if self.state == "closed":
+            return True
+        if self.state == "open" and time.monotonic() - self._opened_at >= self.reset_seconds:
+            self.state = "half_open"
+        if self.state == "half_open" and not self._probing:
+            self._probing = True
+            self.counters["probes"] += 1
+            return True
+        return False
+
+    def _record(self, ok: bool) -> None:
+        self._probing = False
+        if ok:
+            self._failures = 0
+            self.state = "closed"
+            self.counters["successes"] += 1
+            return
+        self._failures += 1
+        self.counters["failures"] += 1
+        if self.state == "half_open" or self._failures >= self.failure_threshold:
+            if self.state != "open":
+                self.counters["opened"] += 1
+            self.state = "open"
+            self._opened_at = time.monotonic()
+
+    async def call(self, request: Callable[[], Awaitable[httpx.Response]]) -> httpx.Response:
+        if not self._allow():
+            self.counters["rejected"] += 1
+            raise CircuitOpenError("inventory circuit open")
+        try:
+            response = await asyncio.wait_for(request(), self.deadline_seconds)
+        except asyncio.TimeoutError:
+            self.counters["timeouts"] += 1
+            self._record(False)
+            raise httpx.TimeoutException("inventory deadline exceeded")
+        except asyncio.CancelledError:
+            # Requête cliente abandonnée : ni succès ni échec du dépendant
+            self._probing = False
+            raise
+        except Exception:
+            self._record(False)
+            raise
+        self._record(response.status_code < 500)
+        return response
+
+    def snapshot(self) -> dict:
+        retry_in = None
+        if self.state == "open":
+            retry_in = max(0.0, round(self.reset_seconds - (time.monotonic() - self._opened_at), 3))
+        return {
+            "state": self.state,
+            "consecutive_failures": self._failures,
+            "retry_in_seconds": retry_in,
+            "failure_threshold": self.failure_threshold,
+            "reset_seconds": self.reset_seconds,
+            "deadline_seconds": self.deadline_seconds,
+            "counters": dict(self.counters),
+        }
+
+
+class InventoryClient:
+    # Client partagé vers inventory-py : un seul httpx.AsyncClient avec pool de
+    # connexions keep-alive, créé au démarrage (ou au premier appel).
+
+    def __init__(
+        self,
+        base_url: str,
+        timeout: float = 10.0,
+        max_connections: int = 100,
+        trip_cache_seconds: float = 60.0,
+        breaker: Optional[CircuitBreaker] = None,
+    ) -> None:
+        self.base_url = base_url
+        self.breaker = breaker or CircuitBreaker()
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.trip_cache_seconds = trip_cache_seconds
+        self._client: Optional[httpx.AsyncClient] = None
+        # Les voyages ne changent pas après création : cache court par trip_id
+        self._trips: Dict[int, tuple] = {}
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=self.timeout,
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections,
+                ),
+            )
+        return self._client
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def _get(self, path: str) -> dict:
+        response = await self.breaker.call(lambda: self.client.get(path))
+        response.raise_for_status()
+        return response.json()
+
+    async def _post(self, path: str, params: Optional[dict] = None) -> dict:
+        response = await self.breaker.call(lambda: self.client.post(path, params=params))
+        response.raise_for_status()
+        return response.json()
+
+    async def get_trip(self, trip_id: int) -> dict:
+        cached = self._trips.get(trip_id)
+        if cached is not None and cached[0] > time.monotonic():
+            return cached[1]
+        trip = await self._get(f"/trips/{trip_id}")
+        if len(self._trips) >= 10000:
+            self._trips.clear()
+        self._trips[trip_id] = (time.monotonic() + self.trip_cache_seconds, trip)
+        return trip
+
+    async def get_trips(self, trip_ids: List[int], chunk_size: int = 100) -> Dict[int, dict]:
+        # Voyages en cache d'abord ; les manquants par lots GET /trips?trip_id=...
+        now = time.monotonic()
+        found: Dict[int, dict] = {}
+        missing: List[int] = []
+        for trip_id in dict.fromkeys(trip_ids):
+            cached = self._trips.get(trip_id)
+            if cached is not None and cached[0] > now:
+                found[trip_id] = cached[1]
+            else:
+                missing.append(trip_id)
+        chunks = [missing[i:i + chunk_size] for i in range(0, len(missing), chunk_size)]
+        results = await asyncio.gather(
+            *(self._get_many("/trips", [("trip_id", t) for t in chunk]) for chunk in chunks),
+            return_exceptions=True,
+        )
+        if len(self._trips) + len(missing) >= 10000:
+            self._trips.clear()
+        expires_at = time.monotonic() + self.trip_cache_seconds
+        for result in results:
+            if isinstance(result, BaseException):
+                continue
+            for trip in result:
+                self._trips[trip["id"]] = (expires_at, trip)
+                found[trip["id"]] = trip
+        return found
+
+    async def _get_many(self, path: str, params: list) -> list:
+        response = await self.breaker.call(lambda: self.client.get(path, params=params))
+        response.raise_for_status()
+        return response.json()
+
+    async def list_stations(self) -> List[dict]:
+        return await self._get("/stations")
+
+    async def allocate_seat(self, trip_id: int, hold_minutes: int) -> dict:
+        return await self._post(f"/trips/{trip_id}/seats/allocate", params={"hold_minutes": hold_minutes})
+
+    async def confirm_seat(self, trip_id: int, seat_no: str) -> dict:
+        return await self._post(f"/trips/{trip_id}/seats/{seat_no}/confirm")
+
+    async def sell_seat(self, trip_id: int, reference: str) -> dict:
+        # Allocation + confirmation en un seul appel, idempotent par référence
+        return await self._post(f"/trips/{trip_id}/seats/sell", params={"reference": reference})
+
+    async def release_seat(self, trip_id: int, reference: str) -> list:
+        return await self._post(f"/trips/{trip_id}/seats/release", params={"reference": reference})
+
+
+class BookingMetrics:
+    # Durées des dernières réservations par étape (fenêtre glissante) et
+    # compteurs d'issues, exposés sur /metrics/booking
+
+    def __init__(self, window: int = 1024) -> None:
+        self.window = window
+        self._durations: Dict[str, Deque[float]] = {}
+        self.outcomes: Counter = Counter()
+
+    @contextmanager
+    def timed(self, step: str, timings: Dict[str, float]):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            timings[step] = elapsed
+            self._durations.setdefault(step, deque(maxlen=self.window)).append(elapsed)
+
+    def snapshot(self) -> dict:
+        steps = {}
+        for step, durations in self._durations.items():
+            ordered = sorted(durations)
+            if not ordered:
+                continue
+            steps[step] = {
+                "count": len(ordered),
+                "p50_ms": round(ordered[len(ordered) // 2] * 1000, 3),
+                "p99_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] * 1000, 3),
+            }
+        return {"steps": steps, "outcomes": dict(self.outcomes)}
+
+
+class IdempotencyCache:
+    # Clés d'idempotence récentes de ce processus. Une requête dupliquée
+    # attend le résultat de la première encore en cours au lieu de réserver
+    # un second siège ; les résultats réussis restent dans un LRU borné, la
+    # base (contrainte unique) reste la référence entre workers.
+
+    def __init__(self, max_entries: int = 10000) -> None:
+        self.max_entries = max_entries
+        self._recent: "OrderedDict[str, dict]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    def __len__(self) -> int:
+        return len(self._recent)
+
+    @property
+    def inflight(self) -> int:
+        return len(self._inflight)
+
+    def remember(self, key: str, result: dict) -> None:
+        self._recent[key] = result
+        self._recent.move_to_end(key)
+        while len(self._recent) > self.max_entries:
+            self._recent.popitem(last=False)
+
+    async def run(
+        self,
+        key: str,
+        compute: Callable[[], Awaitable[dict]],
+        lookup: Callable[[str], Awaitable[Optional[dict]]],
+    ) -> Tuple[dict, str]:
+        # Renvoie (résultat, origine) : "cache", "coalesced", "db" ou "new"
+        while True:
+            cached = self._recent.get(key)
+            if cached is not None:
+                self._recent.move_to_end(key)
+                return cached, "cache"
+            pending = self._inflight.get(key)
+            if pending is None:
+                break
+            try:
+                return await asyncio.shield(pending), "coalesced"
+            except asyncio.CancelledError:
+                if pending.cancelled():
+                    # La requête de tête a été abandonnée : prendre le relais
+                    continue
+                raise
+
+        future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            result, origin = await lookup(key), "db"
+            if result is None:
+                result, origin = await compute(), "new"
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as exc:
+            future.set_exception(exc)
+            # Marquer l'exception comme lue s'il n'y a aucun doublon en attente
+            future.exception()
+            raise
+        else:
+            self.remember(key, result)
+            future.set_result(result)
+            return result, origin
+        finally:
+            self._inflight.pop(key, None)
+
+
+class GroupCommitWriter:
+    # Écriture groupée des réservations : les lignes arrivées pendant la
+    # fenêtre (ou pendant le commit précédent) partent dans une seule
+    # transaction, donc un seul verrou d'écriture et un seul fsync SQLite.
+    # Chaque appelant n'est libéré qu'une fois sa ligne validée.
+
+    def __init__(self, session_factory, window_seconds: float = 0.002, max_batch: int = 64) -> None:
+        self.session_factory = session_factory
+        self.window_seconds = window_seconds
+        self.max_batch = max_batch
+        self.batches = 0
+        self.rows = 0
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._queue = asyncio.Queue()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        # Vider la file avant l'arrêt : aucune réservation en attente perdue
+        if self._task is None:
+            return
+        await self._queue.join()
+        self._task.cancel()
+        self._task = None
+
+    async def submit(self, values: dict) -> None:
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((values, future))
+        await future
+
+    def _drain(self, batch: list) -> list:
+        while len(batch) < self.max_batch and not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        return batch
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = self._drain([await self._queue.get()])
+            deadline = loop.time() + self.window_seconds
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+                self._drain(batch)
+            await self._flush(batch)
+
+    async def _flush(self, batch: list) -> None:
+        try:
+            errors = await asyncio.to_thread(self._commit, [values for values, _ in batch])
+        except Exception as exc:
+            errors = [exc] * len(batch)
+        for (_, future), error in zip(batch, errors):
+            self._queue.task_done()
+            if future.done():
+                continue
+            if error is None:
+                future.set_result(None)
+            else:
+                future.set_exception(error)
+
+    def _commit(self, rows: List[dict]) -> List[Optional[Exception]]:
+        with self.session_factory() as session:
+            try:
+                session.execute(insert(BookingORM), rows)
+                session.commit()
+                self.batches += 1
+                self.rows += len(rows)
+                return [None] * len(rows)
+            except IntegrityError:
+                session.rollback()
+        # Une ligne fautive (clé d'idempotence en double) : ligne par ligne,
+        # pour que seul son appelant reçoive l'erreur
+        errors: List[Optional[Exception]] = []
+        for row in rows:
+            with self.session_factory() as session:
+                try:
+                    session.execute(insert(BookingORM), [row])
+                    session.commit()
+                    self.batches += 1
+                    self.rows += 1
+                    errors.append(None)
+                except IntegrityError as exc:
+                    session.rollback()
+                    errors.append(exc)
+        return errors
+
+
+def server_timing(timings: Dict[str, float]) -> str:
+    return ", ".join(f"{step};dur={elapsed * 1000:.1f}" for step, elapsed in timings.items())
+
+
+SeatClass = Literal["second_class", "first_class", "VIP"]
+PassengerType = Literal["adult", "student", "senior", "child"]
+
+
 class PriceQuoteRequest(BaseModel):
     trip_id: int
     seat_no: str
     passengers: int = 1
+    # Valeurs inconnues refusées (422), comme les règles in:... de Laravel
+    seat_class: SeatClass = "second_class"
+    passenger_type: PassengerType = "adult"
 
 
 class PriceQuoteResponse(BaseModel):
@@ -45,22 +565,101 @@ class PriceQuoteResponse(BaseModel):
     currency: str
 
 
+class BatchQuoteRequest(BaseModel):
+    quotes: List[PriceQuoteRequest] = Field(..., min_length=1, max_length=200)
+
+
+class BatchQuoteResponse(BaseModel):
+    quotes: List[PriceQuoteResponse]
+
+
+class FareEntry(BaseModel):
+    origin_station_id: int
+    destination_station_id: int
+    base_price: float
+
+
 class BookingCreate(BaseModel):
     trip_id: int
     passengers: int = 1
     idempotency_key: Optional[str] = None
 
 
+class Booking(BaseModel):
+    pnr: str
+    trip_id: int
+    seat_no: str
+    amount: float
+    currency: str
+    status: str
+    created_at: Optional[datetime] = None
+
+
+class BookingPage(BaseModel):
+    items: List[Booking]
+    next_cursor: Optional[str] = None
+
+
+def encode_booking_cursor(created_at: datetime, booking_id: int) -> str:
+    raw = json.dumps([created_at.isoformat(), booking_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_booking_cursor(cursor: str) -> tuple:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, booking_id = json.loads(raw)
+        return datetime.fromisoformat(created_at), int(booking_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
 def create_app() -> FastAPI:
     app = FastAPI(title="SETRAG Pricing & Booking (Python)")
 
     inventory_base = os.getenv("INVENTORY_BASE_URL", "http://localhost:8105")
+    inventory = InventoryClient(
+        inventory_base,
+        timeout=float(os.getenv("INVENTORY_TIMEOUT_SECONDS", "10")),
+        max_connections=int(os.getenv("INVENTORY_MAX_CONNECTIONS", "100")),
+        trip_cache_seconds=float(os.getenv("INVENTORY_TRIP_CACHE_SECONDS", "60")),
+        breaker=CircuitBreaker(
+            failure_threshold=int(os.getenv("INVENTORY_BREAKER_FAILURES", "5")),
+            reset_seconds=float(os.getenv("INVENTORY_BREAKER_RESET_SECONDS", "30")),
+            deadline_seconds=float(os.getenv("INVENTORY_DEADLINE_SECONDS", "2")),
+        ),
+    )
+    app.state.inventory = inventory
     users_public_secret = os.getenv("USERS_JWT_SECRET", "dev-secret-change-me")
     db_url = os.getenv("PRICING_DB_URL", "sqlite:///./pricing.db")
     engine = create_engine(db_url, future=True, pool_pre_ping=True,
                            connect_args={"check_same_thread": False} if db_url.startswith("sqlite") else {})
     SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False, future=True)
     Base.metadata.create_all(bind=engine)
+    if "user_id" not in {c["name"] for c in inspect(engine).get_columns("bookings")}:
+        with engine.begin() as conn:
+            conn.execute(text("ALTER TABLE bookings ADD COLUMN user_id INTEGER"))
+    # create_all ne crée pas les index d'une table existante
+    for index in BookingORM.__table__.indexes:
+        index.create(bind=engine, checkfirst=True)
+
+    fare_matrix = FareMatrix()
+    fares_reload_seconds = float(os.getenv("FARES_RELOAD_SECONDS", "30"))
+
+    booking_metrics = BookingMetrics()
+    app.state.booking_metrics = booking_metrics
+    idempotency = IdempotencyCache(int(os.getenv("BOOKING_IDEMPOTENCY_CACHE_SIZE", "10000")))
+    # Sièges vendus sans réservation derrière (libération échouée) : (trip_id, pnr)
+    pending_releases: Dict[tuple, int] = {}
+    app.state.pending_releases = pending_releases
+    release_retry_seconds = float(os.getenv("BOOKING_RELEASE_RETRY_SECONDS", "10"))
+    group_writer: Optional[GroupCommitWriter] = None
+    if os.getenv("BOOKING_GROUP_COMMIT", "0") == "1":
+        group_writer = GroupCommitWriter(
+            SessionLocal,
+            window_seconds=float(os.getenv("BOOKING_GROUP_COMMIT_WINDOW_MS", "2")) / 1000,
+            max_batch=int(os.getenv("BOOKING_GROUP_COMMIT_MAX_BATCH", "64")),
+        )
 
     app.add_middleware(
         CORSMiddleware,
@@ -71,62 +670,145 @@ def create_app() -> FastAPI:
 
     oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/oauth/token")
 
+    token_cache = VerifiedTokenCache(int(os.getenv("AUTH_TOKEN_CACHE_SIZE", "10000")))
+
     def require_user(token: str = Depends(oauth2_scheme)) -> dict:
+        payload = token_cache.get(token)
+        if payload is not None:
+            return payload
         try:
             payload = jwt.decode(token, users_public_secret, algorithms=["HS256"])
+            token_cache.put(token, payload)
             return payload
         except Exception:
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Unauthorized")
 
+    def require_admin(user: dict = Depends(require_user)) -> dict:
+        if user.get("role") != "admin":
+            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Forbidden")
+        return user
+
+    def reload_fares(force: bool = False) -> bool:
+        with SessionLocal() as session:
+            return fare_matrix.reload(session, force=force)
+
+    def upsert_fares(entries: List[FareEntry]) -> None:
+        with SessionLocal() as session:
+            for e in entries:
+                row = session.get(FareORM, (e.origin_station_id, e.destination_station_id))
+                if row is None:
+                    session.add(FareORM(
+                        origin_station_id=e.origin_station_id,
+                        destination_station_id=e.destination_station_id,
+                        base_price=e.base_price,
+                        updated_at=datetime.utcnow(),
+                    ))
+                else:
+                    row.base_price = e.base_price
+                    row.updated_at = datetime.utcnow()
+            session.commit()
+
+    async def bootstrap_default_fares() -> None:
+        # Table vide : traduire les tarifs historiques (par nom) en identifiants
+        with SessionLocal() as session:
+            if session.execute(select(func.count()).select_from(FareORM)).scalar_one():
+                return
+        ids = {st["name"]: st["id"] for st in await inventory.list_stations()}
+        entries = [
+            FareEntry(origin_station_id=ids[o], destination_station_id=ids[d], base_price=price)
+            for (o, d), price in DEFAULT_ROUTE_FARES.items()
+            if o in ids and d in ids
+        ]
+        if entries:
+            await run_in_threadpool(upsert_fares, entries)
+
+    async def run_fares_reloader() -> None:
+        while True:
+            try:
+                await bootstrap_default_fares()
+                await run_in_threadpool(reload_fares)
+            except Exception:
+                # Garder la matrice courante, nouvel essai au prochain tour
+                pass
+            await asyncio.sleep(fares_reload_seconds)
+
+    async def release_sold_seat(trip_id: int, pnr: str, attempts: int = 3) -> bool:
+        # Compensation : remettre en vente le siège vendu sous ce PNR. Idempotent
+        # côté inventory, donc réessayable sans risque.
+        for attempt in range(attempts):
+            try:
+                await inventory.release_seat(trip_id, pnr)
+            except Exception:
+                if attempt + 1 < attempts:
+                    await asyncio.sleep(0.05 * 2 ** attempt)
+                continue
+            pending_releases.pop((trip_id, pnr), None)
+            booking_metrics.outcomes["released"] += 1
+            return True
+        pending_releases[(trip_id, pnr)] = pending_releases.get((trip_id, pnr), 0) + 1
+        booking_metrics.outcomes["release_failed"] += 1
+        return False
+
+    async def run_release_retrier() -> None:
+        while True:
+            await asyncio.sleep(release_retry_seconds)
+            for trip_id, pnr in list(pending_releases):
+                await release_sold_seat(trip_id, pnr, attempts=1)
+
+    @app.on_event("startup")
+    async def on_startup() -> None:
+        await run_in_threadpool(reload_fares, True)
+        app.state.fares_task = asyncio.create_task(run_fares_reloader())
+        app.state.release_task = asyncio.create_task(run_release_retrier())
+        if group_writer is not None:
+            group_writer.start()
+
+    @app.on_event("shutdown")
+    async def on_shutdown() -> None:
+        for name in ("fares_task", "release_task"):
+            task: Optional[asyncio.Task] = getattr(app.state, name, None)
+            if task is not None:
+                task.cancel()
+        if group_writer is not None:
+            await group_writer.stop()
+        await inventory.close()
+
     @app.get("/health")
     def health() -> dict:
         return {"status": "ok"}
 
-    @app.post("/price/quote", response_model=PriceQuoteResponse)
-    def quote(body: PriceQuoteRequest) -> PriceQuoteResponse:
-        # Récupérer les informations du voyage depuis inventory-py
-        try:
-            trip_response = httpx.get(f"{inventory_base}/trips/{body.trip_id}", timeout=10.0)
-            trip_response.raise_for_status()
-            trip_data = trip_response.json()
-            
-            # Récupérer les stations
-            origin_response = httpx.get(f"{inventory_base}/stations/{trip_data['origin_station_id']}", timeout=10.0)
-            origin_response.raise_for_status()
-            origin_station = origin_response.json()
-            
-            dest_response = httpx.get(f"{inventory_base}/stations/{trip_data['destination_station_id']}", timeout=10.0)
-            dest_response.raise_for_status()
-            dest_station = dest_response.json()
-            
-        except Exception:
-            # Fallback si erreur API
-            base_price = 10000.0
-        else:
-            # Tarification basée sur les stations (même logique que le frontend)
-            origin_name = origin_station['name']
-            dest_name = dest_station['name']
-            
-            # Prix basés sur la distance (simulation)
-            if origin_name == 'Libreville' and dest_name == 'Franceville':
-                base_price = 25000.0
-            elif origin_name == 'Franceville' and dest_name == 'Libreville':
-                base_price = 25000.0
-            elif origin_name == 'Libreville' and dest_name == 'Moanda':
-                base_price = 15000.0
-            elif origin_name == 'Moanda' and dest_name == 'Libreville':
-                base_price = 15000.0
-            elif origin_name == 'Libreville' and dest_name == 'Owendo':
-                base_price = 5000.0
-            elif origin_name == 'Owendo' and dest_name == 'Libreville':
-                base_price = 5000.0
-            else:
-                base_price = 10000.0
-        
+    @app.get("/fares", response_model=List[FareEntry])
+    def list_fares() -> List[FareEntry]:
+        with SessionLocal() as session:
+            rows = session.execute(select(FareORM)).scalars().all()
+            return [
+                FareEntry(origin_station_id=r.origin_station_id, destination_station_id=r.destination_station_id, base_price=r.base_price)
+                for r in rows
+            ]
+
+    @app.put("/fares", response_model=dict)
+    def put_fares(entries: List[FareEntry], user=Depends(require_admin)) -> dict:
+        # Mise à jour des tarifs sans redéploiement ; les autres workers la
+        # prennent au prochain rechargement (FARES_RELOAD_SECONDS)
+        upsert_fares(entries)
+        reload_fares(force=True)
+        return {"fares": len(fare_matrix)}
+
+    @app.post("/fares/reload", response_model=dict)
+    def post_fares_reload(user=Depends(require_admin)) -> dict:
+        reload_fares(force=True)
+        return {"fares": len(fare_matrix)}
+
+    def price(base_fare: float, seat_class: SeatClass, passenger_type: PassengerType, passengers: int) -> PriceQuoteResponse:
+        base_price = (
+            base_fare
+            * CLASS_MULTIPLIERS[seat_class]
+            * PASSENGER_MULTIPLIERS[passenger_type]
+            * max(passengers, 1)
+        )
         # Calcul de la commission (5% du prix de base)
         commission = base_price * 0.05
         total_price = base_price + commission
-        
         return PriceQuoteResponse(
             base_price=base_price,
             taxes=commission,  # Renommé en commission dans le frontend
@@ -134,51 +816,195 @@ def create_app() -> FastAPI:
             currency="XAF"
         )
 
-    @app.post("/booking", status_code=201)
-    def booking(body: BookingCreate, user=Depends(require_user)):
-        # Idempotence
-        with SessionLocal() as session:
-            if body.idempotency_key:
-                exists = session.execute(
-                    select(BookingORM).where(BookingORM.idempotency_key == body.idempotency_key)
-                ).scalar_one_or_none()
-                if exists:
-                    return {"pnr": exists.pnr, "amount": exists.amount, "currency": exists.currency}
-
-        # Allocation de siège via inventory-py
+    @app.post("/price/quote", response_model=PriceQuoteResponse)
+    async def quote(body: PriceQuoteRequest) -> PriceQuoteResponse:
+        # Seuls les identifiants de gares du voyage sont nécessaires
         try:
-            r = httpx.post(f"{inventory_base}/trips/{body.trip_id}/seats/allocate", params={"hold_minutes": 20}, timeout=10.0)
-            r.raise_for_status()
-            seat_no = r.json()["seat_no"]
+            trip = await inventory.get_trip(body.trip_id)
         except Exception:
-            raise HTTPException(status_code=409, detail="Seat allocation failed")
+            # Fallback si erreur API
+            base_fare = DEFAULT_BASE_PRICE
+        else:
+            base_fare = fare_matrix.lookup(trip["origin_station_id"], trip["destination_station_id"])
+        return price(base_fare, body.seat_class, body.passenger_type, body.passengers)
 
-        # Prix
-        quote_res = quote(PriceQuoteRequest(trip_id=body.trip_id, seat_no=seat_no, passengers=body.passengers))
+    @app.post("/price/quotes", response_model=BatchQuoteResponse)
+    async def batch_quote(body: BatchQuoteRequest) -> BatchQuoteResponse:
+        # Une page de résultats : voyages récupérés une seule fois (cache ou
+        # lots), puis tous les totaux calculés en une passe
+        trips = await inventory.get_trips([q.trip_id for q in body.quotes])
+        base_fares = [
+            fare_matrix.lookup(trips[q.trip_id]["origin_station_id"], trips[q.trip_id]["destination_station_id"])
+            if q.trip_id in trips else DEFAULT_BASE_PRICE
+            for q in body.quotes
+        ]
+        return BatchQuoteResponse(quotes=[
+            price(base_fare, q.seat_class, q.passenger_type, q.passengers)
+            for base_fare, q in zip(base_fares, body.quotes)
+        ])
 
-        # Confirmation siège
-        try:
-            rc = httpx.post(f"{inventory_base}/trips/{body.trip_id}/seats/{seat_no}/confirm", timeout=10.0)
-            rc.raise_for_status()
-        except Exception:
-            raise HTTPException(status_code=409, detail="Seat confirmation failed")
+    def find_booking_by_key(idempotency_key: str) -> Optional[dict]:
+        with SessionLocal() as session:
+            exists = session.execute(
+                select(BookingORM).where(BookingORM.idempotency_key == idempotency_key)
+            ).scalar_one_or_none()
+            if exists:
+                return {"pnr": exists.pnr, "amount": exists.amount, "currency": exists.currency}
+            return None
 
-        # Créer PNR
-        pnr = str(ULID())
+    def booking_out(row: BookingORM) -> Booking:
+        return Booking(
+            pnr=row.pnr, trip_id=row.trip_id, seat_no=row.seat_no, amount=row.amount,
+            currency=row.currency, status=row.status, created_at=row.created_at,
+        )
+
+    def insert_booking(values: dict) -> None:
         with SessionLocal() as session:
-            row = BookingORM(
-                pnr=pnr,
-                trip_id=body.trip_id,
-                seat_no=seat_no,
-                amount=quote_res.total_price,
-                currency=quote_res.currency,
-                status="CONFIRMED",
-                idempotency_key=body.idempotency_key,
-            )
-            session.add(row)
+            session.add(BookingORM(**values))
             session.commit()
+
+    async def persist_booking(values: dict) -> None:
+        if group_writer is not None:
+            await group_writer.submit(values)
+        else:
+            await run_in_threadpool(insert_booking, values)
+
+    @app.get("/metrics/inventory", response_model=dict)
+    def get_inventory_metrics() -> dict:
+        return inventory.breaker.snapshot()
+
+    @app.get("/metrics/booking", response_model=dict)
+    def get_booking_metrics() -> dict:
+        return {
+            **booking_metrics.snapshot(),
+            "pending_releases": len(pending_releases),
+            "idempotency": {"cached_keys": len(idempotency), "inflight": idempotency.inflight},
+            "group_commit": (
+                {"batches": group_writer.batches, "rows": group_writer.rows} if group_writer is not None else None
+            ),
+        }
+
+    async def book(body: BookingCreate, timings: Dict[str, float], user_id: Optional[int]) -> dict:
+        # Le PNR sert de référence de vente côté inventory : un seul appel
+        # (allocation + confirmation), rejouable et annulable par PNR
+        pnr = str(ULID())
+
+        async def sell() -> str:
+            with booking_metrics.timed("sell", timings):
+                return (await inventory.sell_seat(body.trip_id, pnr))["seat_no"]
+
+        async def priced() -> PriceQuoteResponse:
+            # Voyage en cache + matrice des tarifs, en parallèle de la vente.
+            # Une réservation vend un seul siège : tarif d'un seul passager
+            with booking_metrics.timed("price", timings):
+                return await quote(PriceQuoteRequest(trip_id=body.trip_id, seat_no="", passengers=1))
+
+        seat, quote_res = await asyncio.gather(sell(), priced(), return_exceptions=True)
+        if isinstance(quote_res, BaseException):
+            if not isinstance(seat, BaseException):
+                await release_sold_seat(body.trip_id, pnr)
+            raise quote_res
+        if isinstance(seat, CircuitOpenError):
+            # Rien n'a été envoyé à inventory-py : pas de vente à annuler
+            booking_metrics.outcomes["inventory_unavailable"] += 1
+            raise HTTPException(status_code=503, detail="Inventory unavailable")
+        if isinstance(seat, httpx.HTTPStatusError) and seat.response.status_code < 500:
+            # Refus d'inventory-py (complet...) : rien n'a été vendu
+            booking_metrics.outcomes["seat_unavailable"] += 1
+            raise HTTPException(status_code=409, detail="Seat allocation failed")
+        if isinstance(seat, BaseException):
+            # Délai dépassé, connexion ou erreur serveur : panne d'inventory-py,
+            # pas un train complet. La vente a pu aboutir : on l'annule.
+            await release_sold_seat(body.trip_id, pnr)
+            booking_metrics.outcomes["inventory_error"] += 1
+            raise HTTPException(status_code=503, detail="Inventory unavailable")
+
+        values = dict(
+            pnr=pnr,
+            trip_id=body.trip_id,
+            seat_no=seat,
+            amount=quote_res.total_price,
+            currency=quote_res.currency,
+            status="CONFIRMED",
+            idempotency_key=body.idempotency_key,
+            created_at=datetime.utcnow(),
+            user_id=user_id,
+        )
+        try:
+            with booking_metrics.timed("persist", timings):
+                await persist_booking(values)
+        except IntegrityError:
+            # Même clé d'idempotence réservée en parallèle : rendre le siège en
+            # trop et renvoyer la réservation gagnante
+            await release_sold_seat(body.trip_id, pnr)
+            existing = await run_in_threadpool(find_booking_by_key, body.idempotency_key) if body.idempotency_key else None
+            if existing is None:
+                raise
+            booking_metrics.outcomes["replayed_db"] += 1
+            return existing
+        except Exception:
+            await release_sold_seat(body.trip_id, pnr)
+            booking_metrics.outcomes["failed"] += 1
+            raise
+        booking_metrics.outcomes["confirmed"] += 1
         return {"pnr": pnr, "amount": quote_res.total_price, "currency": quote_res.currency}
 
+    @app.post("/booking", status_code=201)
+    async def booking(body: BookingCreate, response: Response, user=Depends(require_user)):
+        timings: Dict[str, float] = {}
+        user_id = int(user["sub"]) if str(user.get("sub", "")).isdigit() else None
+        if not body.idempotency_key:
+            result = await book(body, timings, user_id)
+        else:
+            async def lookup(key: str) -> Optional[dict]:
+                # Repli sur la base (accès DB hors de la boucle d'événements)
+                with booking_metrics.timed("idempotency", timings):
+                    return await run_in_threadpool(find_booking_by_key, key)
+
+            result, origin = await idempotency.run(body.idempotency_key, lambda: book(body, timings, user_id), lookup)
+            if origin != "new":
+                booking_metrics.outcomes[f"replayed_{origin}"] += 1
+        response.headers["Server-Timing"] = server_timing(timings)
+        return result
+
+    @app.get("/bookings", response_model=BookingPage)
+    def list_my_bookings(
+        limit: int = Query(20, ge=1, le=100),
+        cursor: Optional[str] = None,
+        user=Depends(require_user),
+    ) -> BookingPage:
+        # Parcours de ix_bookings_user_created à partir du curseur : coût
+        # constant quelle que soit la profondeur dans l'historique
+        if not str(user.get("sub", "")).isdigit():
+            return BookingPage(items=[])
+        stmt = select(BookingORM).where(BookingORM.user_id == int(user["sub"]))
+        if cursor:
+            before_created, before_id = decode_booking_cursor(cursor)
+            stmt = stmt.where(or_(
+                BookingORM.created_at < before_created,
+                and_(BookingORM.created_at == before_created, BookingORM.id < before_id),
+            ))
+        stmt = stmt.order_by(BookingORM.created_at.desc(), BookingORM.id.desc()).limit(limit + 1)
+        with SessionLocal() as session:
+            rows = session.execute(stmt).scalars().all()
+            items = [booking_out(r) for r in rows[:limit]]
+            next_cursor = None
+            if len(rows) > limit:
+                last = rows[limit - 1]
+                next_cursor = encode_booking_cursor(last.created_at, last.id)
+        return BookingPage(items=items, next_cursor=next_cursor)
+
+    @app.get("/booking/{pnr}", response_model=Booking)
+    def get_booking(pnr: str, user=Depends(require_user)) -> Booking:
+        with SessionLocal() as session:
+            row = session.execute(select(BookingORM).where(BookingORM.pnr == pnr)).scalar_one_or_none()
+            # Réservation d'un autre client : même réponse qu'un PNR inconnu
+            if row is None or (
+                row.user_id is not None and str(row.user_id) != str(user.get("sub")) and user.get("role") != "admin"
+            ):
+                raise HTTPException(status_code=404, detail="Booking not found")
+            return booking_out(row)
+
     return app
 
 
@@ -0,0 +1,106 @@
+import importlib.util
+import os
+import sys
+import tempfile
+from collections import Counter, defaultdict
+from pathlib import Path
+
+import httpx
+import jwt
+import pytest
+from fastapi.testclient import TestClient
+
+# Before any app.main is imported: module-level apps must not touch the
+# services' own ./pricing.db and ./inventory.db
+_import_dir = tempfile.mkdtemp()
+os.environ["PRICING_DB_URL"] = f"sqlite:///{_import_dir}/pricing.db"
+os.environ["INVENTORY_DATABASE_URL"] = f"sqlite:///{_import_dir}/inventory.db"
+
+import app.main as pricing  # noqa: E402
+
+
+def load_inventory_service():
+    # inventory-py is also an "app" package: load its main module under another name
+    path = Path(__file__).resolve().parents[2] / "inventory-py" / "app" / "main.py"
+    spec = importlib.util.spec_from_file_location("inventory_service", path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+inventory_service = load_inventory_service()
+
+
+class InventoryStandIn(httpx.AsyncBaseTransport):
+    # The real inventory-py app served in process, with faults injected per
+    # action (last path segment: "sell", "release"...). Each queued fault is
+    # used for one call:
+    #   "down"          the request never reaches inventory-py
+    #   "server_error"  inventory-py answers 500 without handling it
+    #   "lost_response" inventory-py handles it (and commits), then the
+    #                   response is lost to a read timeout
+
+    def __init__(self, app) -> None:
+        self.inner = httpx.ASGITransport(app=app)
+        self.faults = defaultdict(list)
+        self.calls = Counter()
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        action = request.url.path.rsplit("/", 1)[-1]
+        self.calls[action] += 1
+        fault = self.faults[action].pop(0) if self.faults[action] else None
+        if fault == "down":
+            raise httpx.ConnectError("injected: inventory down", request=request)
+        if fault == "server_error":
+            return httpx.Response(500, json={"detail": "injected"}, request=request)
+        response = await self.inner.handle_async_request(request)
+        if fault == "lost_response":
+            await response.aread()
+            raise httpx.ReadTimeout("injected: response lost", request=request)
+        return response
+
+
+@pytest.fixture
+def inventory(tmp_path, monkeypatch):
+    monkeypatch.setenv("INVENTORY_DATABASE_URL", f"sqlite:///{tmp_path}/inventory.db")
+    with TestClient(inventory_service.create_app()) as client:
+        yield client
+
+
+@pytest.fixture
+def stand_in(inventory):
+    return InventoryStandIn(inventory.app)
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch, stand_in):
+    monkeypatch.setenv("PRICING_DB_URL", f"sqlite:///{tmp_path}/pricing.db")
+    monkeypatch.setenv("BOOKING_RELEASE_RETRY_SECONDS", "0.05")
+    app = pricing.create_app()
+    app.state.inventory._client = httpx.AsyncClient(transport=stand_in, base_url="http://inventory")
+    with TestClient(app, raise_server_exceptions=False) as client:
+        client.headers["Authorization"] = "Bearer " + jwt.encode(
+            {"sub": "7", "role": "user"}, os.getenv("USERS_JWT_SECRET", "dev-secret-change-me"), algorithm="HS256"
+        )
+        yield client
+
+
+@pytest.fixture
+def make_trip(inventory):
+    def make_trip(seats: int = 5) -> int:
+        # Stations without a fare in the matrix: priced at DEFAULT_BASE_PRICE
+        origin, destination = (
+            inventory.post("/stations", json={"name": name, "latitude": 0.0, "longitude": 9.0}).json()["id"]
+            for name in ("Gare A", "Gare B")
+        )
+        trip_id = inventory.post("/trips", json={
+            "origin_station_id": origin,
+            "destination_station_id": destination,
+            "departure_time": "2030-01-01T08:00:00",
+            "arrival_time": "2030-01-01T12:00:00",
+        }).json()["id"]
+        inventory.post(f"/trips/{trip_id}/seats/seed", params={"count": seats})
+        return trip_id
+
+    return make_trip
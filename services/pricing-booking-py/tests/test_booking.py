@@ -0,0 +1,139 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from sqlalchemy.exc import OperationalError
+
+import app.main as pricing
+
+
+def sold_seats(inventory, trip_id: int) -> int:
+    return inventory.get(f"/trips/{trip_id}/availability").json()["sold"]
+
+
+def my_bookings(client) -> list:
+    return client.get("/bookings").json()["items"]
+
+
+def outcomes(client) -> dict:
+    return client.get("/metrics/booking").json()["outcomes"]
+
+
+def wait_until(condition, timeout: float = 5.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.02)
+    return True
+
+
+@pytest.fixture
+def broken_persist(monkeypatch):
+    # The booking row cannot be written (disk full, lost database...)
+    def broken(**values):
+        raise OperationalError("INSERT INTO bookings", values, Exception("disk I/O error"))
+
+    monkeypatch.setattr(pricing, "BookingORM", broken)
+    return monkeypatch
+
+
+def test_booking_sells_in_one_inventory_call(client, inventory, stand_in, make_trip):
+    trip_id = make_trip()
+    response = client.post("/booking", json={"trip_id": trip_id})
+    assert response.status_code == 201
+    pnr = response.json()["pnr"]
+    assert {step.split(";")[0] for step in response.headers["Server-Timing"].split(", ")} == {"sell", "price", "persist"}
+    assert stand_in.calls["sell"] == 1
+    assert stand_in.calls["allocate"] == stand_in.calls["confirm"] == stand_in.calls["release"] == 0
+    assert sold_seats(inventory, trip_id) == 1
+    assert client.get(f"/booking/{pnr}").json()["seat_no"] == "1A"
+    assert outcomes(client) == {"confirmed": 1}
+
+
+def test_booking_charges_the_one_seat_it_sells(client, inventory, make_trip):
+    trip_id = make_trip()
+    single = client.post("/price/quote", json={"trip_id": trip_id, "seat_no": "", "passengers": 1}).json()
+    booked = client.post("/booking", json={"trip_id": trip_id, "passengers": 3}).json()
+    assert booked["amount"] == single["total_price"]
+    assert sold_seats(inventory, trip_id) == 1
+
+
+def test_sold_out_is_a_conflict_without_compensation(client, inventory, stand_in, make_trip):
+    trip_id = make_trip(seats=1)
+    assert client.post("/booking", json={"trip_id": trip_id}).status_code == 201
+    assert client.post("/booking", json={"trip_id": trip_id}).status_code == 409
+    assert stand_in.calls["release"] == 0
+    assert sold_seats(inventory, trip_id) == 1
+    assert len(my_bookings(client)) == 1
+    assert outcomes(client) == {"confirmed": 1, "seat_unavailable": 1}
+
+
+def test_sell_timeout_after_commit_releases_the_seat(client, inventory, stand_in, make_trip):
+    trip_id = make_trip()
+    stand_in.faults["sell"] = ["lost_response"]
+    assert client.post("/booking", json={"trip_id": trip_id}).status_code == 503
+    # The sale went through on inventory-py: it must have been undone by PNR
+    assert stand_in.calls["release"] == 1
+    assert sold_seats(inventory, trip_id) == 0
+    assert my_bookings(client) == []
+    assert client.app.state.pending_releases == {}
+    assert outcomes(client) == {"released": 1, "inventory_error": 1}
+
+
+@pytest.mark.parametrize("fault", ["down", "server_error"])
+def test_inventory_outage_is_not_sold_out(client, inventory, stand_in, make_trip, fault):
+    trip_id = make_trip()
+    stand_in.faults["sell"] = [fault]
+    response = client.post("/booking", json={"trip_id": trip_id})
+    assert response.status_code == 503
+    assert response.json()["detail"] == "Inventory unavailable"
+    # The outcome is unknown to the caller: release defensively
+    assert stand_in.calls["release"] == 1
+    assert sold_seats(inventory, trip_id) == 0
+    assert outcomes(client) == {"released": 1, "inventory_error": 1}
+
+
+def test_persist_failure_releases_the_seat(client, inventory, stand_in, make_trip, broken_persist):
+    trip_id = make_trip()
+    assert client.post("/booking", json={"trip_id": trip_id}).status_code == 500
+    assert stand_in.calls["release"] == 1
+    assert sold_seats(inventory, trip_id) == 0
+    assert outcomes(client) == {"released": 1, "failed": 1}
+    broken_persist.undo()
+    assert my_bookings(client) == []
+
+
+def test_failed_release_is_retried_in_background(client, inventory, stand_in, make_trip, broken_persist):
+    trip_id = make_trip()
+    stand_in.faults["release"] = ["down"] * 3
+    assert client.post("/booking", json={"trip_id": trip_id}).status_code == 500
+    pending = client.app.state.pending_releases
+    assert [key[0] for key in pending] == [trip_id]
+    assert sold_seats(inventory, trip_id) == 1
+
+    # inventory-py is back: the retrier puts the seat back on sale
+    assert wait_until(lambda: not pending)
+    assert sold_seats(inventory, trip_id) == 0
+    assert outcomes(client) == {"release_failed": 1, "released": 1, "failed": 1}
+
+
+def test_idempotent_replay_returns_the_first_booking(client, inventory, stand_in, make_trip):
+    trip_id = make_trip()
+    body = {"trip_id": trip_id, "idempotency_key": "checkout-42"}
+    first = client.post("/booking", json=body).json()
+    assert client.post("/booking", json=body).json() == first
+    assert stand_in.calls["sell"] == 1
+    assert sold_seats(inventory, trip_id) == 1
+    assert len(my_bookings(client)) == 1
+
+
+def test_concurrent_retries_sell_a_single_seat(client, inventory, make_trip):
+    trip_id = make_trip(seats=20)
+    body = {"trip_id": trip_id, "idempotency_key": "double-click"}
+    with ThreadPoolExecutor(8) as pool:
+        responses = list(pool.map(lambda _: client.post("/booking", json=body), range(16)))
+    assert {r.status_code for r in responses} == {201}
+    assert len({r.json()["pnr"] for r in responses}) == 1
+    assert sold_seats(inventory, trip_id) == 1
+    assert len(my_bookings(client)) == 1
@@ -0,0 +1,24 @@
+import pytest
+
+
+def quote(client, trip_id: int, **fields):
+    return client.post("/price/quote", json={"trip_id": trip_id, "seat_no": "", **fields})
+
+
+@pytest.mark.parametrize("fields, total", [
+    ({}, 10500.0),
+    ({"seat_class": "first_class"}, 15750.0),
+    ({"seat_class": "VIP", "passenger_type": "senior"}, 14700.0),
+    ({"passenger_type": "child"}, 0.0),
+    ({"passenger_type": "student", "passengers": 2}, 18900.0),
+])
+def test_quote_applies_class_passenger_type_and_count(client, make_trip, fields, total):
+    assert quote(client, make_trip(), **fields).json()["total_price"] == pytest.approx(total)
+
+
+@pytest.mark.parametrize("fields", [{"seat_class": "first"}, {"passenger_type": "kid"}])
+def test_unknown_class_or_passenger_type_is_rejected(client, make_trip, fields):
+    trip_id = make_trip()
+    assert quote(client, trip_id, **fields).status_code == 422
+    batch = client.post("/price/quotes", json={"quotes": [{"trip_id": trip_id, "seat_no": "", **fields}]})
+    assert batch.status_code == 422
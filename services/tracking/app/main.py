@@ -2,9 +2,14 @@ from __future__ import annotations
 
 import asyncio
 import json
+import math
 import os
+import struct
+import threading
+import time
+from collections import OrderedDict, deque
 from datetime import datetime, timezone
-from typing import Dict, List, Optional, Set
+from typing import Callable, Deque, Dict, List, Optional, Set, Union
 
 from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect, Query
 from fastapi.middleware.cors import CORSMiddleware
@@ -26,8 +31,10 @@ from sqlalchemy import (
     desc,
     asc,
     Index,
+    func,
+    insert,
 )
-from sqlalchemy.orm import declarative_base, sessionmaker
+from sqlalchemy.orm import aliased, declarative_base, sessionmaker
 
 
 class TrainPosition(BaseModel):
@@ -60,6 +67,448 @@ class TrainPositionORM(Base):
 Index("ix_train_time", TrainPositionORM.train_id, TrainPositionORM.timestamp_utc)
 
 
+class TrainLatestPositionORM(Base):
+    # Dernière position par train, tenue à jour à chaque lot écrit : le
+    # démarrage lit une ligne par train au lieu de parcourir l'historique
+    __tablename__ = "train_latest_positions"
+    train_id = Column(String(64), primary_key=True)
+    latitude = Column(Float, nullable=False)
+    longitude = Column(Float, nullable=False)
+    speed_kmh = Column(Float)
+    bearing_deg = Column(Float)
+    timestamp_utc = Column(DateTime(timezone=True), nullable=False)
+
+
+def latest_table_supported(engine) -> bool:
+    # Mise à jour par INSERT ... ON CONFLICT DO UPDATE
+    return engine.dialect.name in ("sqlite", "postgresql")
+
+
+def upsert_latest_positions(session, rows: List[dict]) -> None:
+    # Une ligne par train (la plus récente du lot), écrite seulement si elle
+    # est plus récente que celle déjà en table
+    def as_utc(value: datetime) -> datetime:
+        # Horodatages naïfs (sans fuseau) considérés comme UTC
+        return value if value.tzinfo is not None else value.replace(tzinfo=timezone.utc)
+
+    newest: Dict[str, dict] = {}
+    for row in rows:
+        current = newest.get(row["train_id"])
+        if current is None or as_utc(row["timestamp_utc"]) >= as_utc(current["timestamp_utc"]):
+            newest[row["train_id"]] = row
+    if session.get_bind().dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as upsert
+    else:
+        from sqlalchemy.dialects.sqlite import insert as upsert
+    stmt = upsert(TrainLatestPositionORM)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[TrainLatestPositionORM.train_id],
+        set_={name: stmt.excluded[name] for name in ("latitude", "longitude", "speed_kmh", "bearing_deg", "timestamp_utc")},
+        where=stmt.excluded.timestamp_utc >= TrainLatestPositionORM.timestamp_utc,
+    )
+    session.execute(stmt, list(newest.values()))
+
+
+def backfill_latest_positions(session) -> None:
+    # Bases antérieures à train_latest_positions : remplissage en une requête
+    if session.execute(select(TrainLatestPositionORM.train_id).limit(1)).first() is not None:
+        return
+    rows = [
+        {
+            "train_id": r.train_id,
+            "latitude": r.latitude,
+            "longitude": r.longitude,
+            "speed_kmh": r.speed_kmh,
+            "bearing_deg": r.bearing_deg,
+            "timestamp_utc": r.timestamp_utc,
+        }
+        for r in select_latest_positions(session)
+    ]
+    if rows:
+        upsert_latest_positions(session, rows)
+
+
+def select_latest_positions(session) -> List[TrainPositionORM]:
+    # Dernière position de chaque train en une seule requête, sans N+1 ni
+    # parcours de l'historique : la CTE récursive saute de train en train
+    # sur ix_train_time (MIN(train_id) > précédent), puis une recherche
+    # ORDER BY timestamp_utc DESC LIMIT 1 par train dans le même index
+    step = aliased(TrainPositionORM)
+    latest = aliased(TrainPositionORM)
+    trains = select(func.min(step.train_id).label("train_id")).cte("trains", recursive=True)
+    trains = trains.union_all(
+        select(
+            select(func.min(step.train_id)).where(step.train_id > trains.c.train_id).scalar_subquery()
+        ).where(trains.c.train_id.is_not(None))
+    )
+    newest_id = (
+        select(latest.id)
+        .where(latest.train_id == trains.c.train_id)
+        .order_by(desc(latest.timestamp_utc))
+        .limit(1)
+        .scalar_subquery()
+    )
+    return session.execute(
+        select(TrainPositionORM).join(trains, TrainPositionORM.id == newest_id)
+    ).scalars().all()
+
+
+class IngestQueueFull(Exception):
+    pass
+
+
+class PositionWriter:
+    # Écriture différée des positions : l'ingestion ne fait qu'empiler dans
+    # une file bornée, une tâche de fond insère par lots (taille atteinte ou
+    # délai écoulé) dans un thread, hors de la boucle d'événements. File
+    # pleine = IngestQueueFull, que l'API traduit en 503 (contre-pression).
+
+    def __init__(
+        self,
+        session_factory,
+        max_pending: int = 100000,
+        batch_size: int = 1000,
+        flush_seconds: float = 0.5,
+        maintain_latest: bool = False,
+    ) -> None:
+        self.session_factory = session_factory
+        self.maintain_latest = maintain_latest
+        self.max_pending = max_pending
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        # (instant d'arrivée, position), pour mesurer le retard d'écriture
+        self._pending: Deque[tuple] = deque()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self.accepted = 0
+        self.rejected = 0
+        self.written = 0
+        self.batches = 0
+        self.flush_errors = 0
+        self.peak_pending = 0
+        self.last_flush_ms = 0.0
+
+    def start(self) -> None:
+        if self._task is None:
+            self._stopping = False
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    @property
+    def free(self) -> int:
+        return max(0, self.max_pending - len(self._pending))
+
+    def submit(self, positions: List[TrainPosition]) -> None:
+        if len(self._pending) + len(positions) > self.max_pending:
+            self.rejected += len(positions)
+            raise IngestQueueFull()
+        now = time.monotonic()
+        self._pending.extend((now, p) for p in positions)
+        self.accepted += len(positions)
+        self.peak_pending = max(self.peak_pending, len(self._pending))
+        self.start()
+        if len(self._pending) >= self.batch_size:
+            self._wakeup.set()
+
+    async def stop(self) -> None:
+        # Arrêt propre : la tâche de fond finit le lot en cours (l'annuler en
+        # pleine écriture perdrait ce lot, déjà retiré de la file), puis
+        # vidage complet de la file
+        if self._task is not None:
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        while self._pending:
+            if not await self._flush():
+                break
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            while self._pending:
+                if not await self._flush():
+                    # Base indisponible : les lignes restent en file, on
+                    # réessaie au prochain tour
+                    break
+                if len(self._pending) < self.batch_size:
+                    break
+
+    async def _flush(self) -> bool:
+        batch = [self._pending.popleft() for _ in range(min(self.batch_size, len(self._pending)))]
+        started = time.perf_counter()
+        try:
+            await asyncio.to_thread(self._insert, batch)
+        except Exception:
+            self.flush_errors += 1
+            self._pending.extendleft(reversed(batch))
+            return False
+        self.last_flush_ms = (time.perf_counter() - started) * 1000
+        self.written += len(batch)
+        self.batches += 1
+        return True
+
+    def _insert(self, batch: List[tuple]) -> None:
+        rows = [
+            {
+                "train_id": p.train_id,
+                "latitude": p.latitude,
+                "longitude": p.longitude,
+                "speed_kmh": p.speed_kmh,
+                "bearing_deg": p.bearing_deg,
+                "timestamp_utc": p.timestamp_utc,
+            }
+            for _, p in batch
+        ]
+        with self.session_factory() as session:
+            session.execute(insert(TrainPositionORM), rows)
+            if self.maintain_latest:
+                upsert_latest_positions(session, rows)
+            session.commit()
+
+    def snapshot(self) -> dict:
+        return {
+            "pending": len(self._pending),
+            "max_pending": self.max_pending,
+            "peak_pending": self.peak_pending,
+            "lag_seconds": round(time.monotonic() - self._pending[0][0], 3) if self._pending else 0.0,
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "written": self.written,
+            "batches": self.batches,
+            "flush_errors": self.flush_errors,
+            "last_flush_ms": round(self.last_flush_ms, 3),
+        }
+
+
+class MqttInbox:
+    # Passage des messages MQTT du thread paho vers la boucle d'événements.
+    # Décodage et validation se font dans le thread paho ; les positions
+    # valides s'accumulent dans un tampon borné et un seul rappel
+    # call_soon_threadsafe par rafale les livre en lot à la boucle.
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, deliver: Callable[[List[tuple]], None], max_pending: int = 50000) -> None:
+        self.loop = loop
+        self.deliver = deliver
+        self.max_pending = max_pending
+        self._buffer: List[tuple] = []
+        self._scheduled = False
+        self._lock = threading.Lock()
+        self.received = 0
+        self.invalid = 0
+        self.dropped = 0
+        self.delivered = 0
+        self.batches = 0
+        self.last_lag_ms = 0.0
+        self.max_lag_ms = 0.0
+
+    def put_raw(self, payload: bytes) -> None:
+        # Appelé depuis le thread paho
+        self.received += 1
+        try:
+            position = TrainPosition.model_validate(json.loads(payload.decode("utf-8")))
+        except Exception:
+            # Messages invalides ignorés (comptés)
+            self.invalid += 1
+            return
+        with self._lock:
+            if len(self._buffer) >= self.max_pending:
+                self.dropped += 1
+                return
+            self._buffer.append((time.monotonic(), position))
+            schedule = not self._scheduled
+            self._scheduled = True
+        if schedule:
+            self.loop.call_soon_threadsafe(self.drain)
+
+    def drain(self) -> None:
+        with self._lock:
+            batch, self._buffer = self._buffer, []
+            self._scheduled = False
+        if not batch:
+            return
+        lag_ms = (time.monotonic() - batch[0][0]) * 1000
+        self.last_lag_ms = lag_ms
+        self.max_lag_ms = max(self.max_lag_ms, lag_ms)
+        self.batches += 1
+        self.delivered += len(batch)
+        self.deliver(batch)
+
+    def snapshot(self) -> dict:
+        return {
+            "received": self.received,
+            "invalid": self.invalid,
+            "dropped": self.dropped,
+            "delivered": self.delivered,
+            "batches": self.batches,
+            "pending": len(self._buffer),
+            "last_lag_ms": round(self.last_lag_ms, 3),
+            "max_lag_ms": round(self.max_lag_ms, 3),
+        }
+
+
+# Trame binaire /ws?encoding=binary, little-endian : version (u8), horodatage
+# (f64, secondes epoch UTC), latitude, longitude, vitesse km/h, cap (f32 ;
+# NaN si absent), longueur de train_id (u8) puis train_id en UTF-8
+POSITION_FRAME_VERSION = 1
+POSITION_FRAME = struct.Struct("<BdffffB")
+
+
+def pack_position(position: TrainPosition) -> bytes:
+    train_id = position.train_id.encode("utf-8")[:255]
+    timestamp = position.timestamp_utc
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return POSITION_FRAME.pack(
+        POSITION_FRAME_VERSION,
+        timestamp.timestamp(),
+        position.latitude,
+        position.longitude,
+        math.nan if position.speed_kmh is None else position.speed_kmh,
+        math.nan if position.bearing_deg is None else position.bearing_deg,
+        len(train_id),
+    ) + train_id
+
+
+def encode_position(position: TrainPosition, encoding: str) -> Union[str, bytes]:
+    return pack_position(position) if encoding == "binary" else position.model_dump_json()
+
+
+class ClientFeed:
+    # File d'envoi d'un client /ws, vidée par sa propre tâche d'écriture :
+    # un client lent ne retarde que lui-même. Politique quand il décroche :
+    # "drop_oldest" (file bornée, on jette le plus ancien) ou "latest"
+    # (seule la dernière position de chaque train attend d'être envoyée).
+
+    def __init__(
+        self, websocket: WebSocket, max_pending: int = 256, policy: str = "drop_oldest", encoding: str = "json"
+    ) -> None:
+        self.websocket = websocket
+        self.max_pending = max_pending
+        self.policy = policy
+        self.encoding = encoding
+        # None = tous les trains, sauf ceux de excluded_ids (désabonnés)
+        self.train_ids: Optional[Set[str]] = None
+        self.excluded_ids: Set[str] = set()
+        self._queue: Deque[Union[str, bytes]] = deque()
+        self._latest: "OrderedDict[str, Union[str, bytes]]" = OrderedDict()
+        self._ready = asyncio.Event()
+        self.sent = 0
+        self.sent_bytes = 0
+        self.dropped = 0
+        self.closed = False
+
+    def wants(self, train_id: str) -> bool:
+        if self.train_ids is None:
+            return train_id not in self.excluded_ids
+        return train_id in self.train_ids
+
+    def offer(self, train_id: str, message: Union[str, bytes]) -> None:
+        if self.policy == "latest":
+            if train_id in self._latest:
+                self.dropped += 1
+            elif len(self._latest) >= self.max_pending:
+                self._latest.popitem(last=False)
+                self.dropped += 1
+            self._latest[train_id] = message
+        else:
+            if len(self._queue) >= self.max_pending:
+                self._queue.popleft()
+                self.dropped += 1
+            self._queue.append(message)
+        self._ready.set()
+
+    def _next(self) -> Optional[Union[str, bytes]]:
+        if self._queue:
+            return self._queue.popleft()
+        if self._latest:
+            return self._latest.popitem(last=False)[1]
+        return None
+
+    async def run(self) -> None:
+        try:
+            while True:
+                await self._ready.wait()
+                self._ready.clear()
+                message = self._next()
+                while message is not None:
+                    if isinstance(message, bytes):
+                        await self.websocket.send_bytes(message)
+                    else:
+                        await self.websocket.send_text(message)
+                    self.sent += 1
+                    self.sent_bytes += len(message)
+                    message = self._next()
+        except Exception:
+            # Client parti : la boucle de réception /ws fait le ménage
+            self.closed = True
+
+
+class PositionFanout:
+    # Diffusion des positions : au plus max_rate_hz envois par train et par
+    # seconde (les positions intermédiaires sont fusionnées, seule la plus
+    # récente part en fin d'intervalle), sérialisation une seule fois par
+    # encodage, puis dépôt non bloquant dans la file de chaque client abonné
+
+    def __init__(self, max_rate_hz: float = 0.0) -> None:
+        self.clients: Set[ClientFeed] = set()
+        self.min_interval = 1.0 / max_rate_hz if max_rate_hz > 0 else 0.0
+        self._last_sent: Dict[str, float] = {}
+        self._held: Dict[str, TrainPosition] = {}
+        self.published = 0
+        self.coalesced = 0
+
+    def publish(self, position: TrainPosition) -> None:
+        if not self.clients:
+            return
+        if self.min_interval:
+            loop = asyncio.get_running_loop()
+            train_id = position.train_id
+            due = self._last_sent.get(train_id, -math.inf) + self.min_interval
+            if loop.time() < due:
+                if train_id in self._held:
+                    self.coalesced += 1
+                else:
+                    loop.call_at(due, self._release, train_id)
+                self._held[train_id] = position
+                return
+            self._last_sent[train_id] = loop.time()
+        self._emit(position)
+
+    def _release(self, train_id: str) -> None:
+        position = self._held.pop(train_id, None)
+        if position is not None:
+            self._last_sent[train_id] = asyncio.get_running_loop().time()
+            self._emit(position)
+
+    def _emit(self, position: TrainPosition) -> None:
+        self.published += 1
+        messages: Dict[str, Union[str, bytes]] = {}
+        for client in self.clients:
+            if client.closed or not client.wants(position.train_id):
+                continue
+            message = messages.get(client.encoding)
+            if message is None:
+                message = messages[client.encoding] = encode_position(position, client.encoding)
+            client.offer(position.train_id, message)
+
+    def snapshot(self) -> dict:
+        return {
+            "clients": len(self.clients),
+            "published": self.published,
+            "coalesced": self.coalesced,
+            "sent": sum(c.sent for c in self.clients),
+            "sent_bytes": sum(c.sent_bytes for c in self.clients),
+            "dropped": sum(c.dropped for c in self.clients),
+            "pending": sum(len(c._queue) + len(c._latest) for c in self.clients),
+        }
+
+
 def create_app() -> FastAPI:
     app = FastAPI(title="SETRAG Tracking Service")
 
@@ -84,22 +533,24 @@ def create_app() -> FastAPI:
     app.state.db_engine = engine
     app.state.SessionLocal = SessionLocal
 
+    # Table des dernières positions (lecture directe au démarrage) ; sinon
+    # le démarrage calcule la dernière position par train sur l'historique
+    use_latest_table = os.getenv("TRACKING_LATEST_TABLE", "1") != "0" and latest_table_supported(engine)
+    position_writer = PositionWriter(
+        SessionLocal,
+        maintain_latest=use_latest_table,
+        max_pending=int(os.getenv("TRACKING_INGEST_MAX_PENDING", "100000")),
+        batch_size=int(os.getenv("TRACKING_INGEST_BATCH_SIZE", "1000")),
+        flush_seconds=float(os.getenv("TRACKING_INGEST_FLUSH_SECONDS", "0.5")),
+    )
+    app.state.position_writer = position_writer
+
     # Mémoire locale simple pour les dernières positions
     last_position_by_train: Dict[str, TrainPosition] = {}
-    websocket_clients: Set[WebSocket] = set()
-
-    async def broadcast_position(position: TrainPosition) -> None:
-        if not websocket_clients:
-            return
-        message = position.model_dump()
-        stale_clients: List[WebSocket] = []
-        for ws in websocket_clients:
-            try:
-                await ws.send_json(message)
-            except Exception:
-                stale_clients.append(ws)
-        for ws in stale_clients:
-            websocket_clients.discard(ws)
+    fanout = PositionFanout(max_rate_hz=float(os.getenv("TRACKING_WS_MAX_HZ", "2")))
+    app.state.fanout = fanout
+    ws_max_pending = int(os.getenv("TRACKING_WS_MAX_PENDING", "256"))
+    ws_default_policy = os.getenv("TRACKING_WS_POLICY", "drop_oldest")
 
     @app.get("/health")
     def health() -> dict:
@@ -117,48 +568,55 @@ def create_app() -> FastAPI:
             raise HTTPException(status_code=404, detail="Train not found")
         return position
 
+    def enqueue_positions(positions: List[TrainPosition]) -> None:
+        # Persistance différée (PositionWriter) ; refus en bloc si la file est pleine
+        try:
+            position_writer.submit(positions)
+        except IngestQueueFull:
+            raise HTTPException(status_code=503, detail="Ingest queue full", headers={"Retry-After": "1"})
+        for p in positions:
+            last_position_by_train[p.train_id] = p
+
+    def deliver_mqtt(batch: List[tuple]) -> None:
+        # Sur la boucle : ce qui dépasse la place libre de la file d'écriture
+        # est perdu (compté), le reste suit le même chemin que l'ingestion HTTP
+        positions = [p for _, p in batch]
+        accepted = positions[:position_writer.free]
+        app.state.mqtt_dropped += len(positions) - len(accepted)
+        if not accepted:
+            return
+        position_writer.submit(accepted)
+        for p in accepted:
+            last_position_by_train[p.train_id] = p
+            fanout.publish(p)
+
+    app.state.mqtt_inbox = None
+    app.state.mqtt_dropped = 0
+
+    @app.get("/metrics/ingest")
+    def ingest_metrics() -> dict:
+        inbox: Optional[MqttInbox] = app.state.mqtt_inbox
+        mqtt_metrics = None
+        if inbox is not None:
+            mqtt_metrics = {**inbox.snapshot(), "dropped_queue_full": app.state.mqtt_dropped}
+        return {**position_writer.snapshot(), "mqtt": mqtt_metrics}
+
+    @app.get("/metrics/ws")
+    def ws_metrics() -> dict:
+        return fanout.snapshot()
+
     @app.post("/position", response_model=TrainPosition)
     async def ingest_position(position: TrainPosition) -> TrainPosition:
-        # Persist
-        session = SessionLocal()
-        try:
-            row = TrainPositionORM(
-                train_id=position.train_id,
-                latitude=position.latitude,
-                longitude=position.longitude,
-                speed_kmh=position.speed_kmh,
-                bearing_deg=position.bearing_deg,
-                timestamp_utc=position.timestamp_utc,
-            )
-            session.add(row)
-            session.commit()
-        finally:
-            session.close()
-        # Update cache + broadcast
-        last_position_by_train[position.train_id] = position
-        await broadcast_position(position)
+        # Persist (différé) + update cache + broadcast
+        enqueue_positions([position])
+        fanout.publish(position)
         return position
 
     @app.post("/positions", response_model=List[TrainPosition])
     async def ingest_positions(payload: PositionsIngestRequest) -> List[TrainPosition]:
-        session = SessionLocal()
-        try:
-            for p in payload.positions:
-                row = TrainPositionORM(
-                    train_id=p.train_id,
-                    latitude=p.latitude,
-                    longitude=p.longitude,
-                    speed_kmh=p.speed_kmh,
-                    bearing_deg=p.bearing_deg,
-                    timestamp_utc=p.timestamp_utc,
-                )
-                session.add(row)
-                last_position_by_train[p.train_id] = p
-            session.commit()
-        finally:
-            session.close()
+        enqueue_positions(payload.positions)
         for p in payload.positions:
-            await broadcast_position(p)
+            fanout.publish(p)
         return payload.positions
 
     @app.get("/positions/search", response_model=List[TrainPosition])
@@ -196,41 +654,85 @@ def create_app() -> FastAPI:
         finally:
             session.close()
 
+    def subscribe(client: ClientFeed, train_ids: List[str]) -> None:
+        if "*" in train_ids:
+            client.train_ids = None
+            client.excluded_ids = set()
+            return
+        if client.train_ids is None:
+            # Client sur tous les trains : lève seulement un désabonnement
+            client.excluded_ids -= set(train_ids)
+        else:
+            client.train_ids |= set(train_ids)
+        # Position connue envoyée tout de suite, sans attendre le prochain point
+        for tid in train_ids:
+            known = last_position_by_train.get(tid)
+            if known is not None:
+                client.offer(tid, encode_position(known, client.encoding))
+
     @app.websocket("/ws")
-    async def websocket_endpoint(websocket: WebSocket) -> None:
+    async def websocket_endpoint(
+        websocket: WebSocket,
+        train_id: List[str] = Query(default=[]),
+        mode: Optional[str] = Query(default=None, pattern="^(drop_oldest|latest)$"),
+        encoding: str = Query(default="json", pattern="^(json|binary)$"),
+    ) -> None:
+        # /ws?train_id=A&train_id=B pour ne recevoir que ces trains (tous par
+        # défaut), puis {"subscribe": [...]} / {"unsubscribe": [...]} en cours
+        # de session ; mode=latest pour ne garder que la dernière position ;
+        # encoding=binary pour des trames POSITION_FRAME au lieu de JSON
         await websocket.accept()
-        websocket_clients.add(websocket)
+        client = ClientFeed(websocket, max_pending=ws_max_pending, policy=mode or ws_default_policy, encoding=encoding)
+        if train_id:
+            client.train_ids = set()
+            subscribe(client, train_id)
+        writer = asyncio.create_task(client.run())
+        fanout.clients.add(client)
         try:
             while True:
-                # Nous n'attendons pas de messages côté client pour l'instant
-                await websocket.receive_text()
+                text = await websocket.receive_text()
+                try:
+                    command = json.loads(text)
+                except ValueError:
+                    continue
+                if not isinstance(command, dict):
+                    continue
+                if isinstance(command.get("subscribe"), list):
+                    subscribe(client, [str(t) for t in command["subscribe"]])
+                if isinstance(command.get("unsubscribe"), list):
+                    unsubscribed = {str(t) for t in command["unsubscribe"]}
+                    if client.train_ids is None:
+                        client.excluded_ids |= unsubscribed
+                    else:
+                        client.train_ids -= unsubscribed
         except WebSocketDisconnect:
-            websocket_clients.discard(websocket)
+            pass
         except Exception:
-            websocket_clients.discard(websocket)
+            pass
+        finally:
+            fanout.clients.discard(client)
+            writer.cancel()
 
     @app.on_event("startup")
     async def on_startup() -> None:
         app.state.loop = asyncio.get_running_loop()
         # DB: create tables + warm last positions cache
         Base.metadata.create_all(bind=engine)
-        # Warm cache with last known position per train
+        position_writer.start()
+        app.state.mqtt_inbox = MqttInbox(
+            app.state.loop, deliver_mqtt, max_pending=int(os.getenv("TRACKING_MQTT_MAX_PENDING", "50000"))
+        )
+        # Warm cache with last known position per train, in a single query
         try:
-            session = SessionLocal()
-            train_ids = [tid for (tid,) in session.execute(select(TrainPositionORM.train_id).distinct())]
-            for tid in train_ids:
-                row = (
-                    session.execute(
-                        select(TrainPositionORM)
-                        .where(TrainPositionORM.train_id == tid)
-                        .order_by(desc(TrainPositionORM.timestamp_utc))
-                        .limit(1)
-                    )
-                    .scalars()
-                    .first()
-                )
-                if row is not None:
-                    last_position_by_train[tid] = TrainPosition(
+            with SessionLocal() as session:
+                if use_latest_table:
+                    backfill_latest_positions(session)
+                    session.commit()
+                    rows = session.execute(select(TrainLatestPositionORM)).scalars().all()
+                else:
+                    rows = select_latest_positions(session)
+                for row in rows:
+                    last_position_by_train[row.train_id] = TrainPosition(
                         train_id=row.train_id,
                         latitude=row.latitude,
                         longitude=row.longitude,
@@ -240,11 +742,6 @@ def create_app() -> FastAPI:
                     )
         except Exception:
             pass
-        finally:
-            try:
-                session.close()
-            except Exception:
-                pass
         mqtt_host = os.getenv("MQTT_HOST")
         mqtt_port = int(os.getenv("MQTT_PORT", "1883"))
         mqtt_topic = os.getenv("MQTT_TOPIC", "setrag/tracking/position")
@@ -255,18 +752,11 @@ def create_app() -> FastAPI:
                 if rc == 0:
                     _client.subscribe(mqtt_topic)
 
+            inbox: MqttInbox = app.state.mqtt_inbox
+
             def on_message(_client, _userdata, msg):
-                try:
-                    payload = msg.payload.decode("utf-8")
-                    data = json.loads(payload)
-                    position = TrainPosition.model_validate(data)
-                    last_position_by_train[position.train_id] = position
-                    asyncio.run_coroutine_threadsafe(
-                        broadcast_position(position), app.state.loop
-                    )
-                except Exception:
-                    # Ignorer silencieusement les messages invalides
-                    return
+                # Thread paho : décodage ici, persistance + diffusion en lot sur la boucle
+                inbox.put_raw(msg.payload)
 
             client.on_connect = on_connect
             client.on_message = on_message
@@ -299,6 +789,10 @@ def create_app() -> FastAPI:
                 await task
             except Exception:
                 pass
+        # Écrire ce qui reste (tampon MQTT compris) avant de quitter
+        if app.state.mqtt_inbox is not None:
+            app.state.mqtt_inbox.drain()
+        await position_writer.stop()
 
     return app
 
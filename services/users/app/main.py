@@ -1,17 +1,24 @@
 from __future__ import annotations
 
+import hashlib
 import os
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime, timedelta, timezone
-from typing import Optional
+from typing import Dict, Optional
 
 import jwt
 from fastapi import Depends, FastAPI, HTTPException, status
+from starlette.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from pydantic import BaseModel, Field
-from sqlalchemy import Column, Integer, String, create_engine, select
+from sqlalchemy import Column, Integer, String, create_engine, select, update
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import declarative_base, sessionmaker
-from passlib.context import CryptContext
+
+from app.passwords import HasherBusy, PasswordHasher
 
 
 Base = declarative_base()
@@ -40,7 +47,69 @@ class UserCreate(BaseModel):
     role: str = Field(default="user")
 
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+class VerifiedTokenCache:
+    # Payloads of tokens whose signature was already checked, keyed by the
+    # token's SHA-256 and dropped at its exp (or after max_ttl_seconds,
+    # whichever comes first). Bounded LRU, shared by the threadpool workers.
+
+    def __init__(self, max_entries: int = 10000, max_ttl_seconds: float = 300.0) -> None:
+        self.max_entries = max_entries
+        self.max_ttl_seconds = max_ttl_seconds
+        self._entries: "OrderedDict[bytes, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token: str) -> Optional[dict]:
+        key = hashlib.sha256(token.encode()).digest()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, token: str, payload: dict) -> None:
+        expires_at = time.time() + self.max_ttl_seconds
+        if isinstance(payload.get("exp"), (int, float)):
+            expires_at = min(expires_at, payload["exp"])
+        key = hashlib.sha256(token.encode()).digest()
+        with self._lock:
+            self._entries[key] = (expires_at, payload)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class UserRecordCache:
+    # Short-lived copies of user rows for authenticated requests. Anything
+    # that modifies a user must call invalidate() so the change is seen at
+    # once by this process; other workers catch up within ttl_seconds.
+
+    def __init__(self, ttl_seconds: float = 30.0, max_entries: int = 10000) -> None:
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: Dict[int, tuple] = {}
+        self._lock = threading.Lock()
+
+    def get(self, user_id: int) -> Optional["User"]:
+        entry = self._entries.get(user_id)
+        if entry is None or entry[0] <= time.monotonic():
+            return None
+        return entry[1]
+
+    def put(self, user: "User") -> None:
+        with self._lock:
+            if len(self._entries) >= self.max_entries:
+                self._entries.clear()
+            self._entries[user.id] = (time.monotonic() + self.ttl_seconds, user)
+
+    def invalidate(self, user_id: int) -> None:
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/oauth/token")
 
 
@@ -51,6 +120,14 @@ def get_settings():
     return secret, db_url, token_exp_minutes
 
 
+def get_hasher() -> PasswordHasher:
+    return PasswordHasher(
+        rounds=int(os.getenv("USERS_BCRYPT_ROUNDS", "12")),
+        workers=int(os.getenv("USERS_HASH_WORKERS", str(max(1, (os.cpu_count() or 2) // 2)))),
+        max_pending=int(os.getenv("USERS_HASH_MAX_PENDING", "64")),
+    )
+
+
 def create_app() -> FastAPI:
     app = FastAPI(title="SETRAG Users Service")
 
@@ -68,6 +145,23 @@ def create_app() -> FastAPI:
     SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False, future=True)
     Base.metadata.create_all(bind=engine)
 
+    token_cache = VerifiedTokenCache(int(os.getenv("AUTH_TOKEN_CACHE_SIZE", "10000")))
+    user_cache = UserRecordCache(float(os.getenv("USERS_RECORD_CACHE_SECONDS", "30")))
+    app.state.user_cache = user_cache
+    hasher = get_hasher()
+    app.state.hasher = hasher
+
+    @app.on_event("shutdown")
+    def on_shutdown() -> None:
+        hasher.shutdown()
+
+    def hasher_busy() -> HTTPException:
+        return HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many password operations, retry shortly",
+            headers={"Retry-After": "1"},
+        )
+
     def create_access_token(user_id: int, email: str, role: str) -> str:
         payload = {
             "sub": str(user_id),
@@ -79,46 +173,93 @@ def create_app() -> FastAPI:
         return jwt.encode(payload, secret, algorithm="HS256")
 
     def get_current_user(token: str = Depends(oauth2_scheme)) -> User:
+        payload = token_cache.get(token)
         try:
-            payload = jwt.decode(token, secret, algorithms=["HS256"])
+            if payload is None:
+                payload = jwt.decode(token, secret, algorithms=["HS256"])
+                token_cache.put(token, payload)
             user_id = int(payload.get("sub"))
         except Exception:
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
+        cached = user_cache.get(user_id)
+        if cached is not None:
+            return cached
         with SessionLocal() as session:
             row = session.execute(select(UserORM).where(UserORM.id == user_id)).scalar_one_or_none()
             if row is None:
                 raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found")
-            return User(id=row.id, email=row.email, full_name=row.full_name, role=row.role)
+            user = User(id=row.id, email=row.email, full_name=row.full_name, role=row.role)
+        user_cache.put(user)
+        return user
 
     @app.get("/health")
     def health() -> dict:
         return {"status": "ok"}
 
-    @app.post("/users", response_model=User, status_code=201)
-    def create_user(user: UserCreate) -> User:
+    def find_user_by_email(email: str) -> Optional[tuple]:
+        with SessionLocal() as session:
+            row = session.execute(select(UserORM).where(UserORM.email == email)).scalar_one_or_none()
+            if row is None:
+                return None
+            return row.id, row.email, row.role, row.password_hash
+
+    def insert_user(user: UserCreate, password_hash: str) -> User:
         with SessionLocal() as session:
-            exists = session.execute(select(UserORM).where(UserORM.email == user.email)).scalar_one_or_none()
-            if exists:
-                raise HTTPException(status_code=409, detail="Email already exists")
             row = UserORM(
                 email=user.email,
-                password_hash=pwd_context.hash(user.password),
+                password_hash=password_hash,
                 full_name=user.full_name,
                 role=user.role,
             )
             session.add(row)
-            session.commit()
+            try:
+                session.commit()
+            except IntegrityError:
+                raise HTTPException(status_code=409, detail="Email already exists")
             session.refresh(row)
+            user_cache.invalidate(row.id)
             return User(id=row.id, email=row.email, full_name=row.full_name, role=row.role)
 
-    @app.post("/oauth/token")
-    def token(form: OAuth2PasswordRequestForm = Depends()):
+    def replace_password_hash(user_id: int, old_hash: str, new_hash: str) -> None:
+        # Only if nobody changed the password since it was verified
         with SessionLocal() as session:
-            row = session.execute(select(UserORM).where(UserORM.email == form.username)).scalar_one_or_none()
-            if row is None or not pwd_context.verify(form.password, row.password_hash):
-                raise HTTPException(status_code=400, detail="Invalid credentials")
-            access_token = create_access_token(row.id, row.email, row.role)
-            return {"access_token": access_token, "token_type": "bearer", "expires_in": 60 * 60}
+            session.execute(
+                update(UserORM)
+                .where(UserORM.id == user_id, UserORM.password_hash == old_hash)
+                .values(password_hash=new_hash)
+            )
+            session.commit()
+
+    @app.post("/users", response_model=User, status_code=201)
+    async def create_user(user: UserCreate) -> User:
+        # Refuse duplicates before paying for a hash; the unique index
+        # still settles concurrent sign-ups
+        if await run_in_threadpool(find_user_by_email, user.email):
+            raise HTTPException(status_code=409, detail="Email already exists")
+        try:
+            password_hash = await hasher.hash(user.password)
+        except HasherBusy:
+            raise hasher_busy()
+        return await run_in_threadpool(insert_user, user, password_hash)
+
+    @app.post("/oauth/token")
+    async def token(form: OAuth2PasswordRequestForm = Depends()):
+        found = await run_in_threadpool(find_user_by_email, form.username)
+        if found is None:
+            raise HTTPException(status_code=400, detail="Invalid credentials")
+        user_id, email, role, password_hash = found
+        try:
+            valid, new_hash = await hasher.verify(form.password, password_hash)
+        except HasherBusy:
+            raise hasher_busy()
+        if not valid:
+            raise HTTPException(status_code=400, detail="Invalid credentials")
+        if new_hash is not None:
+            # Stored with another cost than USERS_BCRYPT_ROUNDS: upgrade now
+            # that the plaintext is at hand
+            await run_in_threadpool(replace_password_hash, user_id, password_hash, new_hash)
+        access_token = create_access_token(user_id, email, role)
+        return {"access_token": access_token, "token_type": "bearer", "expires_in": 60 * 60}
 
     @app.get("/me", response_model=User)
     def me(current: User = Depends(get_current_user)) -> User:
@@ -0,0 +1,94 @@
+from __future__ import annotations
+
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Optional, Tuple
+
+from passlib.context import CryptContext
+
+
+# Kept apart from app.main so pool workers (spawned, not forked) import
+# passlib only, not the FastAPI app and its database.
+
+_contexts: Dict[int, CryptContext] = {}
+
+
+def crypt_context(rounds: int) -> CryptContext:
+    # Hashes made with any other cost are reported as needing an update
+    context = _contexts.get(rounds)
+    if context is None:
+        context = _contexts[rounds] = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=rounds)
+    return context
+
+
+def hash_password(password: str, rounds: int) -> str:
+    return crypt_context(rounds).hash(password)
+
+
+def verify_password(password: str, password_hash: str, rounds: int) -> Tuple[bool, Optional[str]]:
+    # (matches, replacement hash at the current cost or None)
+    return crypt_context(rounds).verify_and_update(password, password_hash)
+
+
+def lower_priority() -> None:
+    # Pool initializer: hashing yields the CPU to the process serving requests
+    try:
+        os.nice(10)
+    except (AttributeError, OSError):
+        pass
+
+
+class HasherBusy(Exception):
+    # More hashing requests queued than max_pending
+    pass
+
+
+class PasswordHasher:
+    # bcrypt on a dedicated process pool: the event loop and the request
+    # threadpool never spend CPU on it, so /me and /health keep answering
+    # during a login spike. At most max_pending calls wait for a worker;
+    # beyond that callers get HasherBusy right away instead of queueing.
+
+    def __init__(self, rounds: int = 12, workers: int = 2, max_pending: int = 64) -> None:
+        self.rounds = rounds
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    @property
+    def pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=lower_priority,
+            )
+        return self._pool
+
+    def shutdown(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    async def _run(self, fn, *args):
+        if self.pending >= self.workers + self.max_pending:
+            raise HasherBusy()
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.pool, fn, *args)
+        except BrokenProcessPool:
+            # A worker died (OOM kill...): start a fresh pool on the next call
+            self.shutdown()
+            raise
+        finally:
+            self.pending -= 1
+
+    async def hash(self, password: str) -> str:
+        return await self._run(hash_password, password, self.rounds)
+
+    async def verify(self, password: str, password_hash: str) -> Tuple[bool, Optional[str]]:
+        return await self._run(verify_password, password, password_hash, self.rounds)